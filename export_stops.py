@@ -0,0 +1,71 @@
+import argparse
+from datetime import date, datetime
+import os
+
+import psycopg2
+import pytz
+
+import ShuttleService
+import StopAnalysis
+from stevens_shuttles import parse_config
+
+
+_EXPORT_QUERY = ('SELECT cs.shuttle, cs.route, cs.stop, cs.arrival_time, cs.expected_time, r.long_name '
+                 'FROM "ConfirmedStop" cs LEFT JOIN "Route" r ON r.id = cs.route '
+                 'WHERE cs.arrival_time >= %s AND cs.arrival_time < %s '
+                 'ORDER BY cs.arrival_time')
+
+
+def export(db: psycopg2, out_path: str, start: date, end: date, local_timezone: str, agency_id: int = 307):
+    """
+    Export ConfirmedStop rows to one columnar partition per local service day
+    :param db: An open database connection
+    :param out_path: The directory to write the partitions into
+    :param start: The first day to export (inclusive)
+    :param end: The last day to export (exclusive)
+    :param local_timezone: A string representing the local timezone, used to split the rows into days
+    :param agency_id: The agency to resolve stop names from
+    :return: A list of the written partition paths
+    """
+    tz = pytz.timezone(local_timezone)
+    stop_names = {stop.id: stop.name for stop in ShuttleService.ShuttleService(agency_id).get_stops()}
+    os.makedirs(out_path, exist_ok=True)
+
+    written = []
+    cur_day, rows = None, []
+    # A named cursor streams rows from the server instead of loading the whole range into memory
+    with db.cursor(name='export_confirmed_stops') as cur:
+        cur.itersize = 10000
+        cur.execute(_EXPORT_QUERY, (tz.localize(datetime.combine(start, datetime.min.time())),
+                                    tz.localize(datetime.combine(end, datetime.min.time()))))
+        for shuttle, route, stop, arrival_time, expected_time, route_name in cur:
+            local_arrival = arrival_time.astimezone(tz)
+            if local_arrival.date() != cur_day:
+                if rows:
+                    written.append(StopAnalysis.write_partition(out_path, cur_day, rows))
+                cur_day, rows = local_arrival.date(), []
+            rows.append((shuttle, route, stop, int(arrival_time.timestamp()),
+                         None if expected_time is None else int(expected_time.timestamp()),
+                         local_arrival.weekday(), route_name or '', stop_names.get(stop, '')))
+    if rows:
+        written.append(StopAnalysis.write_partition(out_path, cur_day, rows))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export confirmed stops to columnar files partitioned by day')
+    parser.add_argument('start', type=date.fromisoformat, help='The first day to export (YYYY-MM-DD)')
+    parser.add_argument('end', type=date.fromisoformat, help='The day after the last day to export (YYYY-MM-DD)')
+    parser.add_argument('-o', '--out', default=os.path.join(os.getcwd(), 'history'), help='The output directory')
+    args = parser.parse_args()
+
+    db: psycopg2 = psycopg2.connect(**parse_config())
+    try:
+        for filename in export(db, args.out, args.start, args.end, 'America/New_York'):
+            print(filename)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pytz
+
+import ScheduleManager
+import ShuttleService
+
+
+def _distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Get the approximate distance in meters between two points, assuming 0.00001 is ~1 meter in geographic coordinates"""
+    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5 / 0.00001
+
+
+class ArrivalService:
+    def __init__(self, scheduler: ScheduleManager.ScheduleManager, average_speed: float = 5.0):
+        """
+        Answers next-arrival queries from the paper schedules and the latest polled shuttle positions.
+        Responses are cached per (route, stop) until the next tick, so queries never reach the TransLoc feed
+        :param scheduler: The schedule manager to read paper schedules and stops from
+        :param average_speed: The average shuttle speed in meters per second, used to estimate live ETAs
+        """
+        self._scheduler = scheduler
+        self._average_speed = average_speed
+
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._tick_time = None
+        self._approaching = {}
+        self._cache = {}
+
+    def update(self, shuttles: List[ShuttleService.Shuttle], now: datetime = None):
+        """
+        Replace the live shuttle snapshot and invalidate every cached response. Call once per tick
+        :param shuttles: The shuttles polled this tick
+        :param now: The time of the tick. Defaults to the current time
+        :return: None
+        """
+        approaching = defaultdict(list)
+        for shuttle in shuttles:
+            next_stop = getattr(shuttle, 'next_stop', None)
+            if isinstance(next_stop, ShuttleService.Stop):
+                next_stop = next_stop.id
+            if next_stop is not None:
+                approaching[(shuttle.route_id, next_stop)].append(shuttle)
+
+        with self._lock:
+            self._tick += 1
+            self._tick_time = now or datetime.now(tz=pytz.utc)
+            self._approaching = approaching
+            self._cache = {}
+
+    def next_arrival(self, route_id: int, stop_id: int) -> bytes:
+        """
+        Get the next scheduled time and the live ETAs for a route and stop
+        :param route_id: The route ID to query
+        :param stop_id: The stop ID to query
+        :return: The JSON-encoded response
+        :raises UnknownRoute: if the route ID could not be found
+        :raises UnknownStop: if the stop is not on the route or has no timetable
+        """
+        key = (route_id, stop_id)
+        with self._lock:
+            tick, tick_time, approaching = self._tick, self._tick_time, self._approaching
+            try:
+                return self._cache[key]
+            except KeyError:
+                pass
+
+        response = json.dumps(self._build_response(route_id, stop_id, tick, tick_time or datetime.now(tz=pytz.utc),
+                                                   approaching.get(key, []))).encode()
+        with self._lock:
+            # Only cache the response if no tick happened while it was being built
+            if self._tick == tick:
+                self._cache[key] = response
+        return response
+
+    def _build_response(self, route_id: int, stop_id: int, tick: int, tick_time: datetime,
+                        approaching: List[ShuttleService.Shuttle]) -> Dict:
+        """
+        Build a next-arrival response
+        :param route_id: The route ID to query
+        :param stop_id: The stop ID to query
+        :param tick: The tick the response is valid for
+        :param tick_time: The time of the tick
+        :param approaching: The shuttles on the route whose next stop is the queried stop
+        :return: The response as a dictionary
+        """
+        try:
+            stops = self._scheduler.stops_by_route()[route_id]
+        except KeyError:
+            raise ScheduleManager.UnknownRoute(f'Route {route_id} is unknown')
+        try:
+            stop = next(s for s in stops if s.id == stop_id)
+        except StopIteration:
+            raise ScheduleManager.UnknownStop(f'Stop {stop_id} not found in route {route_id}')
+
+        scheduled = self._scheduler.get_next_time(route_id, stop_id, tick_time)
+        live = sorted(({'shuttle': shuttle.id,
+                        'eta_seconds': round(_distance(shuttle.position, stop.position) / self._average_speed)}
+                       for shuttle in approaching), key=lambda eta: eta['eta_seconds'])
+        return {
+            'route': route_id,
+            'stop': stop_id,
+            'tick': tick,
+            'scheduled': scheduled.isoformat() if scheduled is not None else None,
+            'live': live
+        }
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    arrivals: ArrivalService = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/next_arrival':
+            self._respond(404, {'error': f'Unknown path {url.path}'})
+            return
+        query = parse_qs(url.query)
+        try:
+            route_id, stop_id = int(query['route'][0]), int(query['stop'][0])
+        except (KeyError, ValueError):
+            self._respond(400, {'error': 'Integer "route" and "stop" parameters are required'})
+            return
+        try:
+            body = self.arrivals.next_arrival(route_id, stop_id)
+        except (ScheduleManager.UnknownRoute, ScheduleManager.UnknownStop) as e:
+            self._respond(404, {'error': str(e)})
+            return
+        self._send(200, body)
+
+    def _respond(self, status: int, data: Dict):
+        self._send(status, json.dumps(data).encode())
+
+    def _send(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request logging would dominate the cost of a cached response
+        pass
+
+
+def serve(arrivals: ArrivalService, host: str = '127.0.0.1', port: int = 8080) -> ThreadingHTTPServer:
+    """
+    Start the query server on a background thread
+    :param arrivals: The arrival service to answer queries from
+    :param host: The host to bind to
+    :param port: The port to bind to
+    :return: The running server. Call shutdown() on it to stop it
+    """
+    handler = type('QueryHandler', (_QueryHandler,), {'arrivals': arrivals})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
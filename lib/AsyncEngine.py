@@ -0,0 +1,224 @@
+import asyncio
+import copy
+from datetime import datetime
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import aiohttp
+import asyncpg
+
+import AsyncShuttleService
+import EventBus
+import EventLog
+import HeadwayMonitor
+import Profiler
+import ScheduleManager
+import ShuttleProcessor
+import ShuttleService
+import StopDetector
+import TickScheduler
+
+
+class AsyncStopWriter:
+    _INSERT = 'INSERT INTO "ConfirmedStop" (shuttle, route, stop, arrival_time, expected_time) VALUES ($1, $2, $3, $4, $5)'
+
+    def __init__(self, pool: asyncpg.pool.Pool, batch_size: int = 100):
+        """
+        Writes confirmed stops to Postgres in batches without blocking the event loop
+        :param pool: The connection pool to write with
+        :param batch_size: The maximum number of rows to insert at once
+        """
+        self._pool = pool
+        self._batch_size = batch_size
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        """
+        Start writing queued rows in the background
+        :return: None
+        """
+        self._task = asyncio.ensure_future(self._write_loop())
+
+    async def close(self):
+        """
+        Write every queued row and stop
+        :return: None
+        """
+        await self._queue.join()
+        if self._task is not None:
+            self._task.cancel()
+
+    def write(self, shuttle_id: int, route_id: int, stop_id: int, arrival_time: datetime, expected_time: datetime):
+        """
+        Queue a confirmed stop to be written
+        :return: None
+        """
+        self._queue.put_nowait((shuttle_id, route_id, stop_id, arrival_time, expected_time))
+
+    async def _write_loop(self):
+        while True:
+            rows = [await self._queue.get()]
+            while len(rows) < self._batch_size and not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            try:
+                async with self._pool.acquire() as conn:
+                    await conn.executemany(AsyncStopWriter._INSERT, rows)
+            except Exception:
+                # Any error must not end the loop, or rows would pile up and close() would never return
+                logging.exception(f'Could not write {len(rows)} confirmed stops')
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+
+class AsyncEngine:
+    def __init__(self, agencies: Dict[int, ScheduleManager.ScheduleManager], writer: AsyncStopWriter, events: EventLog.EventLog,
+                 interval: float = 1.0,
+                 base_url: str = ShuttleService.ShuttleService._BASE_URL, monitors: Dict[int, HeadwayMonitor.HeadwayMonitor] = None,
+                 on_shuttles: Callable[[int, List[ShuttleService.Shuttle]], None] = None, profiler: Profiler.TickProfiler = None,
+                 bus: EventBus.EventBus = None, detector: StopDetector.StopDetector = None, budget: float = None,
+                 report: Callable[[TickScheduler.TickStats], None] = None, report_every: int = 60):
+        """
+        Polls any number of agencies and processes every shuttle on a single event loop.
+        Unlike TickScheduler, a tick's fetch and processing never overlap, and deadlines that pass while a tick runs long are dropped
+        :param agencies: A dictionary mapping agency IDs to their schedule managers
+        :param writer: The writer to queue confirmed stops on
+        :param events: The event log to record detections and errors in
+        :param interval: The time between ticks in seconds
+        :param base_url: The URL of the feed, which can be pointed at a local stub feed
+        :param monitors: An optional dictionary mapping agency IDs to headway monitors
+        :param on_shuttles: An optional callback, called with each agency ID and its shuttles every tick
+        :param profiler: An optional profiler to wrap every tick with
+        :param bus: An optional event bus to publish confirmed stops on
+        :param detector: The stop detector to use. Defaults to one with 30 meter stop boxes
+        :param budget: The time in seconds from a tick's deadline until it finishes before it is counted as late. Defaults to interval
+        :param report: An optional callback, called with a copy of the stats every report_every ticks
+        :param report_every: The number of ticks between reports. Reports are disabled if it is not positive
+        """
+        if interval <= 0:
+            raise ValueError(f'interval must be positive, not {interval}')
+        self._agencies = agencies
+        self._writer = writer
+        self._events = events
+        self._interval = interval
+        self._base_url = base_url
+        self._monitors = monitors or {}
+        self._on_shuttles = on_shuttles
+        self._profiler = profiler
+        self._bus = bus
+        self._detector = detector or StopDetector.StopDetector()
+        self._pruner = ShuttleProcessor.Pruner(self._detector)
+        self._budget = interval if budget is None else budget
+        self._report = report
+        self._report_every = report_every
+        self._running = False
+        self.stats = TickScheduler.TickStats()
+
+    async def run(self, ticks: int = None):
+        """
+        Run ticks until stop() is called or the given number of ticks ran.
+        Deadlines that pass while a tick runs long are skipped
+        :param ticks: The number of ticks to run, or None to run until stopped
+        :return: None
+        """
+        self._running = True
+        loop = asyncio.get_event_loop()
+        async with aiohttp.ClientSession() as session:
+            services = [AsyncShuttleService.AsyncShuttleService(agency_id, session, base_url=self._base_url) for agency_id in self._agencies]
+            count = 0
+            deadline = loop.time()
+            while self._running and (ticks is None or count < ticks):
+                now = loop.time()
+                if now < deadline:
+                    await asyncio.sleep(deadline - now)
+                else:
+                    missed = int((now - deadline) // self._interval)
+                    self.stats.skipped += missed
+                    deadline += missed * self._interval
+
+                start = loop.time()
+                if self._profiler is not None:
+                    with self._profiler.tick():
+                        await self.tick(services)
+                else:
+                    await self.tick(services)
+                lag = start - deadline
+                self.stats.ticks += 1
+                self.stats.processed += 1
+                self.stats.last_lag = lag
+                self.stats.max_lag = max(self.stats.max_lag, lag)
+                self.stats.total_lag += lag
+                if loop.time() - deadline > self._budget:
+                    self.stats.late += 1
+                if self._report is not None and self._report_every > 0 and self.stats.processed % self._report_every == 0:
+                    self._report(copy.copy(self.stats))
+                count += 1
+                deadline += self._interval
+
+    def stop(self):
+        """
+        Stop running after the current tick
+        :return: None
+        """
+        self._running = False
+
+    async def tick(self, services: List[AsyncShuttleService.AsyncShuttleService]):
+        """
+        Fetch every agency's shuttles concurrently and process them
+        :param services: The services of each agency
+        :return: None
+        """
+        results = await asyncio.gather(*(service.get_shuttle_statuses() for service in services), return_exceptions=True)
+        self._pruner.prune(self._agencies.values())
+        for service, shuttles in zip(services, results):
+            if isinstance(shuttles, Exception):
+                self._events.error(f'Could not fetch shuttles: {shuttles!r}', agency_id=service.agency_id)
+                continue
+            if self._on_shuttles is not None:
+                self._on_shuttles(service.agency_id, shuttles)
+            scheduler = self._agencies[service.agency_id]
+            monitor = self._monitors.get(service.agency_id)
+            for shuttle in shuttles:
+                # Processing never awaits, since writes are only queued, so shuttles are processed in turn
+                try:
+                    ShuttleProcessor.process_shuttle(scheduler, shuttle, self._writer.write, self._events, self._detector, monitor, self._bus)
+                except Exception as e:
+                    self._events.error(f'Could not process shuttle: {e!r}', shuttle_id=shuttle.id)
+
+
+async def run(agencies: Dict[int, ScheduleManager.ScheduleManager], db_config: Dict, events: EventLog.EventLog, interval: float = 1.0,
+              monitors: Dict[int, HeadwayMonitor.HeadwayMonitor] = None,
+              on_shuttles: Callable[[int, List[ShuttleService.Shuttle]], None] = None,
+              profiler: Profiler.TickProfiler = None, bus: EventBus.EventBus = None,
+              detector: StopDetector.StopDetector = None, budget: float = None,
+              report: Callable[[TickScheduler.TickStats], None] = None, report_every: int = 60) -> Tuple[AsyncEngine, AsyncStopWriter]:
+    """
+    Connect to the database and run the engine until it is stopped
+    :param agencies: A dictionary mapping agency IDs to their schedule managers
+    :param db_config: The psycopg2-style database parameters, as returned by stevens_shuttles.parse_config
+    :param events: The event log to record detections and errors in
+    :param interval: The time between ticks in seconds
+    :param monitors: An optional dictionary mapping agency IDs to headway monitors
+    :param on_shuttles: An optional callback, called with each agency ID and its shuttles every tick
+    :param profiler: An optional profiler to wrap every tick with
+    :param bus: An optional event bus to publish confirmed stops on
+    :param detector: The stop detector to use. Defaults to one with 30 meter stop boxes
+    :param budget: The time in seconds from a tick's deadline until it finishes before it is counted as late. Defaults to interval
+    :param report: An optional callback, called with a copy of the stats every report_every ticks
+    :param report_every: The number of ticks between reports. Reports are disabled if it is not positive
+    :return: The engine and writer, once the engine stops
+    """
+    pool = await asyncpg.create_pool(host=db_config.get('host'), port=db_config.get('port'), database=db_config.get('database'),
+                                     user=db_config.get('user'), password=db_config.get('password'))
+    writer = AsyncStopWriter(pool)
+    writer.start()
+    engine = AsyncEngine(agencies, writer, events, interval=interval, monitors=monitors, on_shuttles=on_shuttles,
+                         profiler=profiler, bus=bus, detector=detector, budget=budget,
+                         report=report, report_every=report_every)
+    try:
+        await engine.run()
+    finally:
+        await writer.close()
+        await pool.close()
+    return engine, writer
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Dict, List
+
+import aiohttp
+
+from ShuttleService import BadResponse, ObjectNotFound, Route, Shuttle, ShuttleService, Stop
+
+
+class AsyncShuttleService:
+    """
+    Represents a TransLoc shuttle service, using asyncio.
+    Mirrors the endpoints of ShuttleService. Use **kwargs to pass arguments directly to the web request
+    """
+
+    def __init__(self, agency_id: int, session: aiohttp.ClientSession, base_url: str = ShuttleService._BASE_URL):
+        """
+        Initialize a shuttle service for the given agency ID
+        :param agency_id: The agency ID
+        :param session: The session to send requests with. It may be shared between agencies
+        :param base_url: The URL of the feed, which can be pointed at a local stub feed
+        """
+        self.session = session
+        self.agency_id = agency_id
+        self._base_url = base_url
+
+    async def get_route(self, route_id: int, **kwargs) -> Route:
+        """
+        Get a single route
+        :param route_id: the ID of the route
+        :param kwargs: additional kwargs are passed to the web request
+        :return: The desired route
+        :raises ObjectNotFound: if the route could not be found
+        """
+        try:
+            return (await self.get_routes(key_filter={'id': route_id}, **kwargs))[0]
+        except IndexError:
+            raise ObjectNotFound(f'Route ID "{route_id} not found')
+
+    async def get_routes(self, key_filter: Dict = None, **kwargs) -> List[Route]:
+        """
+        Get all routes for the current shuttle agency
+        :param key_filter: A dictionary to filter the results by. See ShuttleService._filter_results for details
+        :param kwargs: additional kwargs are passed to the web request
+        :return: A list of all routes
+        """
+        return [Route(r) for r in await self._generic_request('routes', desired_key='routes', key_filter=key_filter, **kwargs)]
+
+    async def get_stop(self, stop_id: int, **kwargs) -> Stop:
+        """
+        Get a single stop
+        :param stop_id: the ID of the stop
+        :param kwargs: additional kwargs are passed to the web request
+        :return: The desired stop
+        :raises ObjectNotFound: if the stop could not be found
+        """
+        try:
+            return (await self.get_stops(key_filter={'id': stop_id}, **kwargs))[0]
+        except IndexError:
+            raise ObjectNotFound(f'Stop ID "{stop_id} not found')
+
+    async def get_stops(self, key_filter: Dict = None, **kwargs) -> List[Stop]:
+        """
+        Get details on all stops for the current shuttle agency
+        :param key_filter: A dictionary to filter the results by. See ShuttleService._filter_results for details
+        :param kwargs: additional kwargs are passed to the web request
+        :return: A list of all stops
+        """
+        return [Stop(s) for s in await self._generic_request('stops', desired_key='stops', key_filter=key_filter, **kwargs)]
+
+    async def get_shuttle_status(self, shuttle_id: int, raw: bool = False, **kwargs) -> [Shuttle, Dict]:
+        """
+        Get the status of a single shuttle
+        :param shuttle_id: the ID of the shuttle
+        :param raw: If true, do not convert the JSON into an object
+        :param kwargs: additional kwargs are passed to the web request
+        :return: the status of the shuttle
+        :raises ObjectNotFound: if the shuttle status could not be found
+        """
+        try:
+            return (await self.get_shuttle_statuses(key_filter={'id': shuttle_id}, raw=raw, **kwargs))[0]
+        except IndexError:
+            raise ObjectNotFound(f'Shuttle ID "{shuttle_id}" status not found')
+
+    async def get_shuttle_statuses(self, key_filter: Dict = None, raw: bool = False, **kwargs) -> [List[Shuttle], List[Dict]]:
+        """
+        Get details on all currently active shuttles.
+        Detailed shuttles are not supported since they would make blocking requests
+        :param key_filter: A dictionary to filter the results by. See ShuttleService._filter_results for details
+        :param raw: If true, do not convert the JSON into an object
+        :param kwargs: additional kwargs are passed to the web request
+        :return: A list of all currently active shuttles
+        """
+        vehicles = await self._generic_request('vehicle_statuses', desired_key='vehicles', key_filter=key_filter, **kwargs)
+        if raw:
+            return vehicles
+        return [Shuttle(v) for v in vehicles]
+
+    async def get_stop_ids_for_route(self, route_id: int, **kwargs) -> List[int]:
+        """
+        Get stop IDs for a single route
+        :param route_id: The route ID to get stops for
+        :param kwargs: additional kwargs are passed to the web request
+        :return: A list of route IDs
+        """
+        try:
+            return (await self.get_stop_ids_for_routes(key_filter={'id': route_id}, **kwargs))[route_id]
+        except KeyError:
+            raise ObjectNotFound(f'Route ID "{route_id}" not found')
+
+    async def get_stop_ids_for_routes(self, key_filter: Dict = None, **kwargs) -> Dict[int, List]:
+        """
+        Get stop IDs by route for the current shuttle agency
+        :param key_filter: A dictionary to filter the results by. See ShuttleService._filter_results for details
+        :param kwargs: additional kwargs are passed to the web request
+        :return: A dict mapping route IDs to stops
+        """
+        data = await self._generic_request('stops', params={'include_routes': 'True'}, desired_key='routes', key_filter=key_filter, **kwargs)
+        return {d['id']: d['stops'] for d in data}
+
+    async def _generic_request(self, endpoint: str, params: Dict = None, method: str = 'GET',
+                               timeout: int = 10, desired_key: str = None, key_filter: Dict = None, **kwargs) -> [Dict, List[Dict]]:
+        """
+        Send a request to the transloc api
+        :param endpoint: The endpoint to query
+        :param params: The params to send
+        :param method: The method to form the request as
+        :param timeout: The request timeout
+        :param desired_key: An optional key to return from the JSON response, instead of the entire JSON object
+        :param key_filter: A dictionary to filter the results by. See ShuttleService._filter_results for details
+        :param kwargs: kwargs passed to the web request
+        :return: The JSON response
+        :raises TimeoutError: If the request times out
+        :raises BadResponse: If the response status code is greater than 200
+        :raises ValueError: If the response is not valid JSON
+        """
+        if params is None:
+            params = {}
+        params['agencies'] = self.agency_id
+
+        try:
+            async with self.session.request(method, f'{self._base_url}{endpoint}', params=params,
+                                            timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as res:
+                if res.status > 200:
+                    raise BadResponse(res.status)
+                try:
+                    response = await res.json(content_type=None)
+                except ValueError:
+                    raise ValueError(f'{method} request for {endpoint} was not valid JSON')
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'{method} request timed out for {endpoint} ({timeout} seconds)')
+
+        if desired_key is not None:
+            try:
+                response = response[desired_key]
+            except KeyError:
+                raise KeyError(f'Desired key "{desired_key}" was not found')
+        if key_filter is not None:
+            return ShuttleService._filter_results(response, key_filter)
+        return response
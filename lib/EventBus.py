@@ -0,0 +1,184 @@
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from typing import Iterable, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import ShuttleService
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscription:
+    def __init__(self, topics: Iterable[str], max_buffer: int, disconnect_slow: bool):
+        """
+        A subscriber's bounded buffer of published messages
+        :param topics: The topics to receive, or None for every topic
+        :param max_buffer: The number of messages to buffer before the subscriber is considered slow
+        :param disconnect_slow: Whether to close a slow subscriber instead of dropping its oldest messages
+        """
+        self.topics = None if topics is None else set(topics)
+        self.dropped = 0
+        self.closed = False
+        self._disconnect_slow = disconnect_slow
+        self._buffer = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+
+    def _put(self, topic: str, frame: bytes):
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+                if self._disconnect_slow:
+                    self.closed = True
+            self._buffer.append((topic, frame))
+            self._cond.notify()
+
+    def get(self, timeout: float = None) -> List[Tuple[str, bytes]]:
+        """
+        Wait for messages and take every buffered one
+        :param timeout: The longest time to wait in seconds, or None to wait forever
+        :return: A list of (topic, JSON-encoded message) tuples, which is empty on timeout or once closed
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or self.closed, timeout=timeout)
+            if self.closed:
+                return []
+            messages = list(self._buffer)
+            self._buffer.clear()
+            return messages
+
+    def close(self):
+        """
+        Stop receiving messages and wake up any waiting reader
+        :return: None
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class EventBus:
+    def __init__(self, max_buffer: int = 256, disconnect_slow: bool = False):
+        """
+        Fans published messages out to every subscriber.
+        Each message is encoded once, and publishing never blocks on a slow subscriber
+        :param max_buffer: The number of messages each subscriber may buffer
+        :param disconnect_slow: Whether to close subscribers whose buffer overflows instead of dropping their oldest messages
+        """
+        self._max_buffer = max_buffer
+        self._disconnect_slow = disconnect_slow
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, topics: Iterable[str] = None) -> Subscription:
+        """
+        Subscribe to published messages
+        :param topics: The topics to receive, or None for every topic
+        :return: The subscription. Unsubscribe it when done
+        """
+        subscription = Subscription(topics, self._max_buffer, self._disconnect_slow)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Remove and close a subscription
+        :param subscription: The subscription to remove
+        :return: None
+        """
+        subscription.close()
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def publish(self, topic: str, data):
+        """
+        Publish a message to every subscriber of a topic
+        :param topic: The topic of the message
+        :param data: The message. It must be JSON serializable, except for datetimes
+        :return: None
+        """
+        # Subscribing replaces the list instead of changing it, so it can be iterated without the lock
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        frame = json.dumps(data, default=_json_default, separators=(',', ':')).encode()
+        for subscription in subscriptions:
+            if subscription.closed:
+                self.unsubscribe(subscription)
+            elif subscription.topics is None or topic in subscription.topics:
+                subscription._put(topic, frame)
+
+    def publish_stop(self, shuttle: ShuttleService.Shuttle, stop: ShuttleService.Stop, expected_time: datetime,
+                     arrival_time: datetime = None):
+        """Publish a confirmed stop to the stops topic. The arrival time defaults to the shuttle's timestamp"""
+        self.publish('stops', {'shuttle_id': shuttle.id, 'route_id': shuttle.route_id, 'stop_id': stop.id, 'stop_name': stop.name,
+                               'arrival_time': arrival_time or shuttle.timestamp, 'expected_time': expected_time})
+
+    def publish_positions(self, shuttles: List[ShuttleService.Shuttle]):
+        """Publish the positions of every shuttle polled in a tick to the positions topic"""
+        self.publish('positions', [{'shuttle_id': shuttle.id, 'route_id': shuttle.route_id, 'position': shuttle.position,
+                                    'timestamp': shuttle.timestamp} for shuttle in shuttles])
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    bus: EventBus = None
+    heartbeat: float = 15.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/events':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        topics = query['topics'][0].split(',') if 'topics' in query else None
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        subscription = self.bus.subscribe(topics)
+        try:
+            while not subscription.closed:
+                messages = subscription.get(timeout=self.heartbeat)
+                if not messages:
+                    # A comment keeps the connection open and detects clients that went away
+                    self.wfile.write(b': heartbeat\n\n')
+                for topic, frame in messages:
+                    self.wfile.write(b'event: ' + topic.encode() + b'\ndata: ' + frame + b'\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.bus.unsubscribe(subscription)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(bus: EventBus, host: str = '127.0.0.1', port: int = 8082, heartbeat: float = 15.0) -> ThreadingHTTPServer:
+    """
+    Stream published messages as server-sent events from /events on a background thread.
+    Clients may pass ?topics=stops,positions to only receive some topics
+    :param bus: The event bus to stream from
+    :param host: The host to bind to
+    :param port: The port to bind to
+    :param heartbeat: The time in seconds between heartbeats on an idle stream
+    :return: The running server. Call shutdown() on it to stop it
+    """
+    handler = type('StreamHandler', (_StreamHandler,), {'bus': bus, 'heartbeat': heartbeat})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,123 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import re
+import shutil
+import sys
+from typing import Callable, NamedTuple
+
+import pytz
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _EventQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Event records only hold plain data, so skip formatting here and leave it to the writer thread
+        return record
+
+
+class _CompressingFileHandler(RotatingFileHandler):
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        """A size-rotated file handler that gzips each rotated file"""
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.namer = lambda name: f'{name}.gz'
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, route_name: Callable[[int], str] = None):
+        """
+        Formats event records as single-line JSON
+        :param route_name: An optional function to resolve route IDs to names, called on the writer thread
+        """
+        super().__init__()
+        self._route_name = route_name
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {'time': datetime.fromtimestamp(record.created, tz=pytz.utc), 'type': record.event_type}
+        data.update(record.event)
+        if self._route_name is not None and 'route_id' in record.event:
+            try:
+                data['route_name'] = self._route_name(record.event['route_id'])
+            except Exception:
+                data['route_name'] = None
+        return json.dumps(data, default=_json_default, separators=(',', ':'))
+
+
+class EventLog:
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 10, echo: bool = False,
+                 route_name: Callable[[int], str] = None):
+        """
+        A structured event stream written as JSONL by a background thread.
+        Recording an event only queues it, so it costs almost nothing on the calling thread
+        :param path: The path of the event log. Rotated files are gzipped next to it
+        :param max_bytes: The size at which the event log is rotated
+        :param backup_count: The number of rotated files to keep
+        :param echo: Whether to also write every event to stdout
+        :param route_name: An optional function to resolve route IDs to names, called on the writer thread
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        formatter = JsonFormatter(route_name)
+        handlers = [_CompressingFileHandler(path, max_bytes, backup_count)]
+        if echo:
+            handlers.append(logging.StreamHandler(sys.stdout))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        self._queue = queue.Queue()
+        self._listener = QueueListener(self._queue, *handlers)
+        self._logger = logging.getLogger(f'{__name__}.{os.path.abspath(path)}')
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.handlers = [_EventQueueHandler(self._queue)]
+        self._listener.start()
+
+    def close(self):
+        """
+        Write every queued event and stop the writer thread
+        :return: None
+        """
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+    def record(self, event_type: str, **fields):
+        """
+        Queue an event
+        :param event_type: The type of the event
+        :param fields: The fields of the event. Datetimes are written in ISO format
+        :return: None
+        """
+        self._logger.info(event_type, extra={'event_type': event_type, 'event': fields})
+
+    def detection(self, shuttle_id: int, route_id: int, stop_id: int, stop_name: str, arrival_time: datetime, expected_time: datetime):
+        """Record a confirmed stop"""
+        self.record('detection', shuttle_id=shuttle_id, route_id=route_id, stop_id=stop_id, stop_name=stop_name,
+                    arrival_time=arrival_time, expected_time=expected_time)
+
+    def unknown_route(self, shuttle_id: int, route_id: int):
+        """Record a shuttle on a route without any known stops"""
+        self.record('unknown_route', shuttle_id=shuttle_id, route_id=route_id)
+
+    def error(self, message: str, **fields):
+        """Record an error"""
+        self.record('error', message=message, **fields)
+
+    def headway_event(self, event: NamedTuple):
+        """Record an event raised by a HeadwayMonitor"""
+        self.record(re.sub(r'(?<!^)(?=[A-Z])', '_', type(event).__name__).lower(), **event._asdict())
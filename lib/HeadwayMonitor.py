@@ -0,0 +1,205 @@
+from collections import deque
+from datetime import datetime
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import ShuttleService
+
+
+class Bunching(NamedTuple):
+    """A shuttle arrived at a stop much sooner after the previous shuttle than usual"""
+    route_id: int
+    stop_id: int
+    shuttle_id: int
+    leader_id: int
+    headway: float
+    mean_headway: float
+    timestamp: datetime
+
+    def __str__(self):
+        return (f'Bunching on route {self.route_id} at stop {self.stop_id}: shuttle {self.shuttle_id} arrived '
+                f'{self.headway:.0f}s after shuttle {self.leader_id} (mean headway {self.mean_headway:.0f}s) at {self.timestamp}')
+
+
+class RouteSubstitution(NamedTuple):
+    """A shuttle stopped at a stop that is only served by other routes"""
+    shuttle_id: int
+    route_id: int
+    stop_id: int
+    serving_routes: Tuple[int, ...]
+    timestamp: datetime
+
+    def __str__(self):
+        return (f'Shuttle {self.shuttle_id} on route {self.route_id} stopped at stop {self.stop_id}, '
+                f'which is only served by routes {self.serving_routes}, at {self.timestamp}')
+
+
+class HeadwayStats:
+    def __init__(self, window: int):
+        """
+        Headway statistics over a sliding window of arrivals, updated in constant time per arrival
+        :param window: The number of headways to keep
+        """
+        self.headways = deque(maxlen=window)
+        self.last_arrival = None
+        self.last_shuttle = None
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.headways)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self.headways) if self.headways else None
+
+    @property
+    def stdev(self) -> Optional[float]:
+        if not self.headways:
+            return None
+        mean = self.mean
+        # Clamp to 0 since the running sums can drift slightly below it
+        return max(self._sum_squares / len(self.headways) - mean * mean, 0.0) ** 0.5
+
+    def add(self, headway: float):
+        """
+        Add a headway, evicting the oldest one if the window is full
+        :param headway: The headway in seconds
+        :return: None
+        """
+        if len(self.headways) == self.headways.maxlen:
+            evicted = self.headways[0]
+            self._sum -= evicted
+            self._sum_squares -= evicted * evicted
+        self.headways.append(headway)
+        self._sum += headway
+        self._sum_squares += headway * headway
+
+
+class HeadwayMonitor:
+    def __init__(self, stops_by_route: Dict[int, List[ShuttleService.Stop]], window: int = 10,
+                 bunching_ratio: float = 0.25, min_samples: int = 3, cell_size: float = 0.001):
+        """
+        Tracks the headways between confirmed stops at every (route, stop) and raises bunching and route substitution events
+        :param stops_by_route: A dictionary mapping route IDs to lists of stops, as returned by ScheduleManager.stops_by_route
+        :param window: The number of recent headways to keep for each (route, stop)
+        :param bunching_ratio: A headway shorter than this fraction of the mean headway is considered bunching
+        :param min_samples: The number of headways required before bunching is reported for a (route, stop)
+        :param cell_size: The size in degrees of the grid cells used to find the stops near a shuttle (0.001 is ~100 meters)
+        """
+        self._window = window
+        self._bunching_ratio = bunching_ratio
+        self._min_samples = min_samples
+        self._cell_size = cell_size
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_foreign_stop = {}
+        self._foreign_stops = {}
+        self._serving_routes = {}
+        self._grid = {}
+        self.update_routes(stops_by_route)
+
+    def update_routes(self, stops_by_route: Dict[int, List[ShuttleService.Stop]]):
+        """
+        Recompute which stops are served by which routes
+        :param stops_by_route: A dictionary mapping route IDs to lists of stops
+        :return: None
+        """
+        serving_routes = {}
+        all_stops = {}
+        for route_id, stops in stops_by_route.items():
+            for stop in stops:
+                serving_routes.setdefault(stop.id, set()).add(route_id)
+                all_stops[stop.id] = stop
+        self._serving_routes = {stop_id: tuple(sorted(routes)) for stop_id, routes in serving_routes.items()}
+        self._foreign_stops = {route_id: [stop for stop_id, stop in all_stops.items() if route_id not in serving_routes[stop_id]]
+                               for route_id in stops_by_route}
+        grid = {}
+        for stop in all_stops.values():
+            grid.setdefault(self._cell(stop.position), []).append(stop)
+        self._grid = grid
+
+    def _cell(self, point: Tuple[float, float]) -> Tuple[int, int]:
+        return int(point[0] // self._cell_size), int(point[1] // self._cell_size)
+
+    def foreign_stops(self, route_id: int) -> List[ShuttleService.Stop]:
+        """
+        Get the stops that are not served by a route
+        :param route_id: The route ID
+        :return: A list of the stops served only by other routes
+        """
+        return self._foreign_stops.get(route_id, [])
+
+    def foreign_stops_near(self, route_id: int, start: Tuple[float, float], end: Tuple[float, float],
+                           box_size: int) -> List[ShuttleService.Stop]:
+        """
+        Get the stops that are not served by a route and whose box a segment could pass through.
+        Only the grid cells around the segment are searched, so the cost does not grow with the size of the network
+        :param route_id: The route ID
+        :param start: The start of the segment
+        :param end: The end of the segment
+        :param box_size: The width and height in meters of the box around each stop
+        :return: A list of the nearby stops served only by other routes
+        """
+        margin = box_size / 2 * 0.00001
+        low = self._cell((min(start[0], end[0]) - margin, min(start[1], end[1]) - margin))
+        high = self._cell((max(start[0], end[0]) + margin, max(start[1], end[1]) + margin))
+        grid = self._grid
+        serving_routes = self._serving_routes
+        found = []
+        for x in range(low[0], high[0] + 1):
+            for y in range(low[1], high[1] + 1):
+                found.extend(stop for stop in grid.get((x, y), ()) if route_id not in serving_routes[stop.id])
+        return found
+
+    def stats(self, route_id: int, stop_id: int) -> Optional[HeadwayStats]:
+        """Get the headway statistics for a route and stop, if any arrivals were recorded"""
+        return self._stats.get((route_id, stop_id))
+
+    def record_arrival(self, shuttle_id: int, route_id: int, stop_id: int, timestamp: datetime) -> List[Bunching]:
+        """
+        Record a confirmed stop and update the headway statistics of its route and stop
+        :param shuttle_id: The ID of the shuttle that stopped
+        :param route_id: The route the shuttle is on
+        :param stop_id: The stop the shuttle stopped at
+        :param timestamp: The time of the stop
+        :return: A list of the events raised by this arrival
+        """
+        events = []
+        with self._lock:
+            # The shuttle is back on its own route, so a later foreign stop is a new substitution
+            self._last_foreign_stop.pop(shuttle_id, None)
+            try:
+                stats = self._stats[(route_id, stop_id)]
+            except KeyError:
+                stats = self._stats[(route_id, stop_id)] = HeadwayStats(self._window)
+
+            # Arrivals from different threads may be recorded slightly out of order, so ignore anything older
+            if stats.last_arrival is not None and timestamp > stats.last_arrival:
+                headway = (timestamp - stats.last_arrival).total_seconds()
+                # Compare against the statistics before this headway so a bunch does not dilute its own baseline
+                if stats.count >= self._min_samples and stats.last_shuttle != shuttle_id and \
+                        headway < self._bunching_ratio * stats.mean:
+                    events.append(Bunching(route_id, stop_id, shuttle_id, stats.last_shuttle, headway, stats.mean, timestamp))
+                stats.add(headway)
+            if stats.last_arrival is None or timestamp > stats.last_arrival:
+                stats.last_arrival = timestamp
+                stats.last_shuttle = shuttle_id
+        return events
+
+    def record_foreign_stop(self, shuttle_id: int, route_id: int, stop_id: int, timestamp: datetime) -> Optional[RouteSubstitution]:
+        """
+        Record a shuttle at a stop that its route does not serve
+        :param shuttle_id: The ID of the shuttle
+        :param route_id: The route the shuttle reports
+        :param stop_id: The stop the shuttle is at
+        :param timestamp: The time the shuttle was at the stop
+        :return: A route substitution event, or None if the shuttle was already reported at this stop
+        """
+        with self._lock:
+            if self._last_foreign_stop.get(shuttle_id) == stop_id:
+                return None
+            self._last_foreign_stop[shuttle_id] = stop_id
+        return RouteSubstitution(shuttle_id, route_id, stop_id, self._serving_routes.get(stop_id, ()), timestamp)
@@ -0,0 +1,314 @@
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import pstats
+import signal
+import socketserver
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+class CallTimer:
+    def __init__(self, sample_every: int = 100):
+        """
+        Times a sample of the calls to instrumented methods
+        :param sample_every: Time one call out of every sample_every calls of each method
+        :raises ValueError: if sample_every is less than 1
+        """
+        if sample_every < 1:
+            raise ValueError(f'sample_every must be at least 1, not {sample_every}')
+        self._sample_every = sample_every
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def instrument(self, cls: type, methods: Iterable[str] = None):
+        """
+        Wrap methods of a class so that a sample of their calls is timed
+        :param cls: The class to instrument
+        :param methods: The names of the methods to wrap. Defaults to every public method defined on the class
+        :return: None
+        """
+        if methods is None:
+            methods = [name for name, value in vars(cls).items() if callable(value) and not name.startswith('_')]
+        for name in methods:
+            method = getattr(cls, name)
+            if getattr(method, '_call_timer', None) is not None:
+                continue
+            setattr(cls, name, self._wrap(f'{cls.__name__}.{name}', method))
+
+    def _wrap(self, name: str, method):
+        calls = itertools.count()
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            # next() on a count is atomic, so sampling needs no lock
+            if next(calls) % self._sample_every:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._record(name, time.perf_counter() - start)
+
+        wrapper._call_timer = self
+        return wrapper
+
+    def _record(self, name: str, elapsed: float):
+        with self._lock:
+            count, total, longest = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + elapsed, max(longest, elapsed))
+
+    def timings(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get the timings of the sampled calls
+        :return: A dictionary mapping method names to the sample count and the mean and max time in seconds
+        """
+        with self._lock:
+            return {name: {'samples': count, 'mean': total / count, 'max': longest}
+                    for name, (count, total, longest) in sorted(self._timings.items())}
+
+
+class _Sampler:
+    def __init__(self, interval: float):
+        """
+        Samples the stacks of every thread on a background thread
+        :param interval: The time between samples in seconds
+        """
+        self._interval = interval
+        self._stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path: str):
+        """Write the samples as collapsed stacks, which most flame graph tools accept"""
+        with open(path, 'w') as out_file:
+            for stack, count in self._stacks.most_common():
+                print(stack, count, file=out_file)
+
+
+class TickProfiler:
+    CPROFILE = 'cprofile'
+    SAMPLING = 'sampling'
+
+    def __init__(self, out_path: str, call_timer: CallTimer = None, sample_interval: float = 0.005):
+        """
+        Profiles the next N ticks on request, without restarting the service.
+        Requests may come from any thread or a signal handler and take effect at the next tick boundary.
+        cProfile sessions cover the thread that runs each tick, and any work wrapped in profiled() on other threads.
+        Sampling sessions cover every thread
+        :param out_path: The directory to write profiles into
+        :param call_timer: An optional call timer whose timings are written alongside each profile
+        :param sample_interval: The time between stack samples in seconds for sampling sessions
+        """
+        self._out_path = out_path
+        self._call_timer = call_timer
+        self._sample_interval = sample_interval
+
+        self._lock = threading.Lock()
+        self._request = None
+        self._mode = None
+        self._remaining = 0
+        self._profile = None
+        self._thread_profiles = []
+        self._session = 0
+        self._sampler = None
+
+    def request(self, ticks: int, mode: str = CPROFILE):
+        """
+        Profile the given number of ticks, starting at the next tick
+        :param ticks: The number of ticks to profile. 0 stops the current session
+        :param mode: CPROFILE or SAMPLING
+        :return: None
+        :raises ValueError: if the mode is unknown
+        """
+        if mode not in (TickProfiler.CPROFILE, TickProfiler.SAMPLING):
+            raise ValueError(f'Unknown profiling mode "{mode}"')
+        # Rebinding is atomic and _begin_tick swaps the request out, so no lock is needed.
+        # Taking one here could deadlock when called from a signal handler while the main thread holds it
+        self._request = (ticks, mode)
+
+    def status(self) -> str:
+        """Get a description of the current session"""
+        with self._lock:
+            if self._mode is None:
+                return 'idle'
+            return f'{self._mode}, {self._remaining} ticks remaining'
+
+    @contextmanager
+    def tick(self):
+        """
+        Wrap the work of a single tick
+        :return: A context manager
+        """
+        self._begin_tick()
+        try:
+            yield
+        finally:
+            self._end_tick()
+
+    @contextmanager
+    def profiled(self):
+        """
+        Wrap work done outside the tick's thread, such as fetching or per-shuttle worker threads,
+        so that cProfile sessions include it. cProfile only sees the thread that enables it
+        :return: A context manager
+        """
+        with self._lock:
+            session = self._session if self._mode == TickProfiler.CPROFILE else None
+        if session is None:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                # Work that outlives its session is dropped rather than merged into the next one
+                if self._session == session and self._mode == TickProfiler.CPROFILE:
+                    self._thread_profiles.append(profile)
+
+    def _begin_tick(self):
+        with self._lock:
+            request, self._request = self._request, None
+        if request is not None:
+            self._finish()
+            ticks, mode = request
+            if ticks > 0:
+                self._start(ticks, mode)
+        if self._profile is not None:
+            self._profile.enable()
+
+    def _end_tick(self):
+        if self._profile is not None:
+            self._profile.disable()
+        with self._lock:
+            if self._mode is None:
+                return
+            self._remaining -= 1
+            done = self._remaining <= 0
+        if done:
+            self._finish()
+
+    def _start(self, ticks: int, mode: str):
+        if mode == TickProfiler.CPROFILE:
+            self._profile = cProfile.Profile()
+        else:
+            self._sampler = _Sampler(self._sample_interval)
+            self._sampler.start()
+        with self._lock:
+            self._session += 1
+            self._thread_profiles = []
+            self._mode = mode
+            self._remaining = ticks
+        logging.info(msg=f'Profiling the next {ticks} ticks ({mode})')
+
+    def _finish(self) -> Optional[str]:
+        """
+        Stop the current session and write its results
+        :return: The path of the written profile, or None if there was no session
+        """
+        with self._lock:
+            mode, self._mode = self._mode, None
+            thread_profiles, self._thread_profiles = self._thread_profiles, []
+        if mode is None:
+            return None
+
+        os.makedirs(self._out_path, exist_ok=True)
+        base = os.path.join(self._out_path, time.strftime('%Y%m%d-%H%M%S'))
+        if self._profile is not None:
+            path = f'{base}.prof'
+            stats = pstats.Stats(self._profile)
+            for profile in thread_profiles:
+                stats.add(profile)
+            stats.dump_stats(path)
+            self._profile = None
+        else:
+            path = f'{base}.stacks'
+            self._sampler.stop()
+            self._sampler.dump(path)
+            self._sampler = None
+        if self._call_timer is not None:
+            with open(f'{base}.timings.json', 'w') as timings_file:
+                json.dump(self._call_timer.timings(), timings_file, indent=2)
+        logging.info(msg=f'Wrote profile to {path}')
+        return path
+
+    def install_signal_handlers(self, ticks: int = 30):
+        """
+        Start a cProfile session over the next ticks on SIGUSR1 and stop the current session on SIGUSR2.
+        Must be called from the main thread. The handlers never take a lock, since they interrupt the main thread
+        :param ticks: The number of ticks to profile on SIGUSR1
+        :return: None
+        """
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.request(ticks))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.request(0))
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8081) -> socketserver.ThreadingTCPServer:
+        """
+        Accept line-based commands on a local control socket on a background thread:
+        "start [ticks] [cprofile|sampling]", "stop" and "status"
+        :param host: The host to bind to
+        :param port: The port to bind to
+        :return: The running server. Call shutdown() on it to stop it
+        """
+        profiler = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(f'{profiler._command(line.decode().split())}\n'.encode())
+
+        server = socketserver.ThreadingTCPServer((host, port), ControlHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _command(self, args) -> str:
+        """
+        Run a control socket command
+        :param args: The words of the command
+        :return: The response
+        """
+        if not args:
+            return 'error: empty command'
+        if args[0] == 'status':
+            return self.status()
+        if args[0] == 'stop':
+            self.request(0)
+            return 'ok'
+        if args[0] == 'start':
+            try:
+                ticks = int(args[1]) if len(args) > 1 else 30
+                self.request(ticks, args[2] if len(args) > 2 else TickProfiler.CPROFILE)
+            except ValueError as e:
+                return f'error: {e}'
+            return 'ok'
+        return f'error: unknown command "{args[0]}"'
@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+import threading
+from typing import Dict, List, Optional
+
+import pytz
+
+import ShuttleService
+
+
+class StopRule:
+    """A per-stop exception to the default validation of confirmed stops"""
+
+    def allow_repeat(self, away: timedelta) -> bool:
+        """
+        Check whether a shuttle may be confirmed at this stop again without being confirmed at another stop in between
+        :param away: The time since the shuttle was last seen at this stop
+        :return: True if the repeat counts as a new arrival, False otherwise
+        """
+        return False
+
+
+class Terminal(StopRule):
+    def __init__(self, min_away: timedelta = timedelta(minutes=5)):
+        """
+        A stop where shuttles start and end their loops, like Howe Center.
+        Shuttles lay over there, and may come back to it before any other stop is confirmed,
+        so a repeat counts as a new arrival once the shuttle has not been seen there for a while
+        :param min_away: The time a shuttle must not have been seen at the stop for a repeat to count
+        """
+        self.min_away = min_away
+
+    def allow_repeat(self, away: timedelta) -> bool:
+        return away >= self.min_away
+
+
+class _Vehicle:
+    def __init__(self, route_id: int):
+        self.route_id = route_id
+        # The position of the last confirmed stop in the route's sequence, if known
+        self.index = None
+        self.stop_id = None
+        self.seen = None
+        self.misses = 0
+        # When the shuttle was last processed, used to forget shuttles that left service
+        self.updated = datetime.now(pytz.utc)
+
+
+class RouteTopology:
+    def __init__(self, stops_by_route: Dict[int, List[ShuttleService.Stop]], lookahead: int = 3, rescan_after: int = 30,
+                 rules: Dict[int, StopRule] = None):
+        """
+        Tracks where each shuttle is in its route's stop sequence, so that only the few stops it can reach next are tested
+        :param stops_by_route: A dictionary mapping route IDs to lists of stops in route order,
+        as returned by ScheduleManager.stops_by_route
+        :param lookahead: The least number of stops after the last confirmed stop to test.
+        More are tested when the feed's next stop is further along the route
+        :param rescan_after: The number of ticks without a confirmed stop after which every stop on the route is tested,
+        in case the shuttle went off-sequence
+        :param rules: An optional dictionary mapping stop IDs to the rules for those stops
+        """
+        self._lookahead = lookahead
+        self._rescan_after = rescan_after
+        self._rules = dict(rules or {})
+        self._lock = threading.Lock()
+        self._vehicles = {}
+        self._sequences = {}
+        self._positions = {}
+        self.update_routes(stops_by_route)
+
+    def update_routes(self, stops_by_route: Dict[int, List[ShuttleService.Stop]]):
+        """
+        Replace the stop sequences of every route
+        :param stops_by_route: A dictionary mapping route IDs to lists of stops in route order
+        :return: None
+        """
+        positions = {}
+        for route_id, stops in stops_by_route.items():
+            route_positions = positions[route_id] = {}
+            for index, stop in enumerate(stops):
+                route_positions.setdefault(stop.id, []).append(index)
+        with self._lock:
+            self._sequences = {route_id: list(stops) for route_id, stops in stops_by_route.items()}
+            self._positions = positions
+            # Positions in the old sequences are meaningless now
+            for vehicle in self._vehicles.values():
+                vehicle.index = None
+
+    def set_rule(self, stop_id: int, rule: Optional[StopRule]):
+        """
+        Set or remove the rule of a stop
+        :param stop_id: The stop the rule applies to
+        :param rule: The rule, or None to remove it
+        :return: None
+        """
+        with self._lock:
+            if rule is None:
+                self._rules.pop(stop_id, None)
+            else:
+                self._rules[stop_id] = rule
+
+    def _locate(self, route_id: int, stop_id: int, start: Optional[int]) -> Optional[int]:
+        """Find the first position of a stop in a route's sequence at or after start, wrapping around"""
+        indices = self._positions.get(route_id, {}).get(stop_id)
+        if not indices:
+            return None
+        if start is not None:
+            for index in indices:
+                if index >= start:
+                    return index
+        return indices[0]
+
+    def candidates(self, shuttle: ShuttleService.Shuttle) -> Optional[List[ShuttleService.Stop]]:
+        """
+        Get the stops a shuttle could reach next, going by its last confirmed stop and the feed's next stop.
+        Should be called once per tick for each shuttle
+        :param shuttle: The polled shuttle
+        :return: The stops to test in route order, or None if every stop on the route should be tested
+        """
+        next_stop = getattr(shuttle, 'next_stop', None)
+        if isinstance(next_stop, ShuttleService.Stop):
+            next_stop = next_stop.id
+
+        with self._lock:
+            sequence = self._sequences.get(shuttle.route_id)
+            if not sequence:
+                return None
+            vehicle = self._vehicles.get(shuttle.id)
+            if vehicle is None or vehicle.route_id != shuttle.route_id:
+                vehicle = self._vehicles[shuttle.id] = _Vehicle(shuttle.route_id)
+            vehicle.updated = datetime.now(pytz.utc)
+
+            length = len(sequence)
+            anchor = None if vehicle.index is None else (vehicle.index + 1) % length
+            next_index = None if next_stop is None else self._locate(shuttle.route_id, next_stop, anchor)
+            if next_index is not None and anchor is None:
+                # The stop before the feed's next stop may have just been passed
+                anchor = (next_index - 1) % length
+            if anchor is None:
+                return None
+            # Test every stop from the last confirmed one through the feed's next stop,
+            # since a long segment may cross more stops than the lookahead
+            span = 0 if next_index is None else (next_index - anchor) % length + 1
+            window = min(max(self._lookahead, span), length)
+
+            vehicle.misses += 1
+            if vehicle.misses > self._rescan_after:
+                vehicle.misses = 0
+                return None
+            candidates = []
+            for offset in range(window):
+                stop = sequence[(anchor + offset) % length]
+                # A terminal is listed at both ends of a loop
+                if all(candidate.id != stop.id for candidate in candidates):
+                    candidates.append(stop)
+            return candidates
+
+    def validate(self, shuttle_id: int, stop_id: int, route_id: int = None, arrival_time: datetime = None) -> bool:
+        """
+        Check whether a shuttle at a stop is a new arrival, and if so move the shuttle to that stop in its route's sequence.
+        A shuttle seen at the same stop twice in a row is not a new arrival, unless the stop's rule allows it
+        :param shuttle_id: The ID of the shuttle
+        :param stop_id: The ID of the stop
+        :param route_id: The route of the shuttle. Without it, the shuttle's position in the sequence is not tracked
+        :param arrival_time: The time the shuttle arrived at the stop. Without it, stop rules are not applied
+        :return: True if the arrival is new, False otherwise
+        """
+        # TODO Save this state to DB on close so that it can be loaded when the program starts
+        with self._lock:
+            vehicle = self._vehicles.get(shuttle_id)
+            if vehicle is None or (route_id is not None and vehicle.route_id != route_id):
+                vehicle = self._vehicles[shuttle_id] = _Vehicle(route_id)
+            vehicle.updated = datetime.now(pytz.utc)
+
+            if vehicle.stop_id == stop_id:
+                rule = self._rules.get(stop_id)
+                valid = (rule is not None and arrival_time is not None and vehicle.seen is not None
+                         and rule.allow_repeat(arrival_time - vehicle.seen))
+                if arrival_time is not None and (vehicle.seen is None or arrival_time > vehicle.seen):
+                    vehicle.seen = arrival_time
+                if not valid:
+                    return False
+
+            vehicle.stop_id = stop_id
+            vehicle.seen = arrival_time
+            vehicle.misses = 0
+            if route_id is not None:
+                start = None if vehicle.index is None else vehicle.index + 1
+                vehicle.index = self._locate(route_id, stop_id, start)
+            return True
+
+    def prune(self, before: datetime):
+        """
+        Forget every shuttle that was not processed since the given time
+        :param before: The cutoff time, in wall clock time rather than feed time
+        :return: None
+        """
+        with self._lock:
+            self._vehicles = {shuttle_id: vehicle for shuttle_id, vehicle in self._vehicles.items()
+                              if vehicle.updated >= before}
@@ -0,0 +1,203 @@
+from collections import OrderedDict, defaultdict
+import csv
+from datetime import date, datetime, time, timedelta
+import json
+import os
+import threading
+from typing import Dict, List, NamedTuple, TextIO, Tuple
+
+import pytz
+
+
+class Schedule:
+
+    def __init__(self, route_id: int, timetable: Dict[int, List[datetime]], start_time: datetime, name: str = None):
+        """
+        A paper schedule
+        :param route_id: The route ID that this schedule is valid for
+        :param timetable: The timetable listing the times for each stop ID
+        :param start_time: The earliest time in the schedule's timetable
+        :param name: The name of the schedule
+        """
+        self.route_id = route_id
+        self.start_time = start_time
+        self.timetable = timetable
+        self.name = name
+
+    def __str__(self):
+        # Get the longest timetable length
+        loop_count = max([len(t) for t in self.timetable.values()])
+        return f'{self.name + ":" or ""} {self.route_id}: {len(self.timetable)} columns, {loop_count} loops'
+
+
+class _StopTime(NamedTuple):
+    stop_id: int
+    day_offset: int
+    time: time
+
+
+class _Template:
+    def __init__(self, name: str, file_info: Dict, stop_ids: List[int], stop_times: List[_StopTime]):
+        """
+        A parsed schedule file that has not been placed on a date yet
+        :param name: The name of the schedule
+        :param file_info: The information about the file from the metafile
+        :param stop_ids: The stop IDs of the schedule's columns
+        :param stop_times: The stop times in file order, relative to the service day
+        """
+        self.name = name
+        self.route_id = file_info['route_id']
+        self.valid_days = set(file_info['valid_days'])
+        self.overlap_days = set(file_info['overlap_days'])
+        self.stop_ids = stop_ids
+        self.stop_times = stop_times
+        self.effective_from = date.fromisoformat(file_info['effective_from']) if file_info.get('effective_from') else None
+        self.effective_until = date.fromisoformat(file_info['effective_until']) if file_info.get('effective_until') else None
+
+    def runs_on(self, service_date: date) -> bool:
+        """Check whether this schedule starts on the given date"""
+        if self.effective_from is not None and service_date < self.effective_from:
+            return False
+        if self.effective_until is not None and service_date > self.effective_until:
+            return False
+        return service_date.weekday() in self.valid_days
+
+
+class ScheduleCalendar:
+    def __init__(self, schedules_path: str, local_timezone: str, cache_size: int = 14):
+        """
+        Materializes paper schedules for any date on demand.
+        Schedule files are parsed once, and the timetables of recently used service days are kept in a bounded LRU.
+        A schedule's file info may set effective_from and effective_until (inclusive ISO dates) so that
+        several versions of a schedule can be kept side by side
+        :param schedules_path: The path where the CSVs of the schedules are stored
+        :param local_timezone: A string representing the local timezone
+        :param cache_size: The maximum number of service days to keep materialized
+        """
+        self._tz = pytz.timezone(local_timezone)
+        self._schedules_path = schedules_path
+        self._cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._days = OrderedDict()
+        self._templates = []
+        self.reload()
+
+    def reload(self):
+        """
+        Re-read the schedule files from the disk and drop every materialized day
+        :return: None
+        """
+        with open(os.path.join(self._schedules_path, 'file_info.json'), 'r') as info_file:
+            all_file_info = json.load(info_file)['file_info']
+        templates = []
+        for schedule_filename in sorted(f for f in os.listdir(self._schedules_path) if os.path.splitext(f)[-1] == '.csv'):
+            with open(os.path.join(self._schedules_path, schedule_filename)) as schedule_file:
+                templates.append(_Template(os.path.splitext(schedule_filename)[0], all_file_info[schedule_filename],
+                                           *self._parse_schedule_file(schedule_file)))
+        with self._lock:
+            self._templates = templates
+            self._days = OrderedDict()
+
+    def schedules_starting(self, service_date: date) -> List[Schedule]:
+        """
+        Get the schedules that start on the given date
+        :param service_date: The local date to materialize
+        :return: A list of schedules with absolute (UTC) stop times
+        """
+        with self._lock:
+            try:
+                self._days.move_to_end(service_date)
+                return self._days[service_date]
+            except KeyError:
+                templates = self._templates
+
+        schedules = [self._materialize(template, service_date) for template in templates if template.runs_on(service_date)]
+        with self._lock:
+            self._days[service_date] = schedules
+            self._days.move_to_end(service_date)
+            while len(self._days) > self._cache_size:
+                self._days.popitem(last=False)
+        return schedules
+
+    def schedules_on(self, service_date: date) -> Dict[int, List[Schedule]]:
+        """
+        Get every schedule that runs on the given date, including schedules from the previous day that overlap it
+        :param service_date: The local date to get schedules for
+        :return: A dictionary mapping route IDs to a list of schedules for that route
+        """
+        schedules = defaultdict(list)
+        for schedule in self.schedules_starting(service_date):
+            schedules[schedule.route_id].append(schedule)
+        overlapping = {template.name for template in self._templates if service_date.weekday() in template.overlap_days}
+        for schedule in self.schedules_starting(service_date - timedelta(days=1)):
+            if schedule.name in overlapping:
+                schedules[schedule.route_id].append(schedule)
+        return schedules
+
+    def schedules_between(self, start: date, end: date) -> Dict[int, List[Schedule]]:
+        """
+        Get every schedule that runs between two dates
+        :param start: The first local date (inclusive)
+        :param end: The last local date (inclusive)
+        :return: A dictionary mapping route IDs to a list of schedules for that route, ordered by start time
+        """
+        schedules = defaultdict(list)
+        for route_id, route_schedules in self.schedules_on(start).items():
+            schedules[route_id].extend(route_schedules)
+        # Schedules overlapping into later days already started on a day in the range
+        for day in range(1, (end - start).days + 1):
+            for schedule in self.schedules_starting(start + timedelta(days=day)):
+                schedules[schedule.route_id].append(schedule)
+        for route_schedules in schedules.values():
+            route_schedules.sort(key=lambda s: s.start_time)
+        return schedules
+
+    def _materialize(self, template: _Template, service_date: date) -> Schedule:
+        """
+        Place a parsed schedule on a date
+        :param template: The parsed schedule
+        :param service_date: The local date the schedule starts on
+        :return: A Schedule object with absolute (UTC) stop times
+        """
+        timetable = {stop_id: [] for stop_id in template.stop_ids}
+        first_time = None
+        for stop_time in template.stop_times:
+            utc_time = self._convert_to_utc(datetime.combine(service_date + timedelta(days=stop_time.day_offset), stop_time.time))
+            if first_time is None:
+                first_time = utc_time
+            timetable[stop_time.stop_id].append(utc_time)
+        return Schedule(template.route_id, timetable, first_time, name=template.name)
+
+    @staticmethod
+    def _parse_schedule_file(schedule_file: TextIO) -> Tuple[List[int], List[_StopTime]]:
+        """
+        Parse a schedule file into stop times relative to its service day
+        :param schedule_file: The opened file handle of the schedule
+        :return: A tuple of (the stop IDs of the columns, the stop times in file order)
+        """
+        data = csv.reader(schedule_file)
+        stops = [int(col) for col in data.__next__()]
+
+        stop_times = []
+        day_offset = 0
+        last_time = None
+        for line in data:
+            for stop_id, str_time in zip(stops, line):
+                if str_time.lower() == 'none':
+                    continue
+                raw_time = datetime.strptime(str_time, '%I:%M%p').time()
+                # If the current time is in the AM but the last time is in the PM
+                # then midnight was crossed
+                if last_time is not None and raw_time.hour < 12 <= last_time.hour:
+                    day_offset += 1
+                last_time = raw_time
+                stop_times.append(_StopTime(stop_id, day_offset, raw_time))
+        return stops, stop_times
+
+    def _convert_to_utc(self, local_time: datetime) -> datetime:
+        """
+        Convert a naive local datetime to UTC.
+        Times skipped by a DST transition are moved forward by the transition and repeated times use standard time
+        """
+        return self._tz.normalize(self._tz.localize(local_time, is_dst=False)).astimezone(pytz.utc)
@@ -1,25 +1,17 @@
-import os
-import csv
-import datetime
-import json
-from itertools import cycle
-from collections import defaultdict
-from typing import Dict, List, TextIO
+from bisect import bisect_left
+from typing import Dict, List, Optional
 from multiprocessing import Lock
 from multiprocessing.managers import BaseManager
-from datetime import date, datetime, timedelta
+from datetime import datetime
 
 import pytz
 
+from ScheduleCalendar import Schedule
+import RouteTopology
+import ScheduleCalendar
 import ShuttleService
 
 
-def _get_weekday(num: int) -> int:
-    """Get the weekday for an integer, assuming 0 is Monday"""
-    day_list = [0, 1, 2, 3, 4, 5, 6]
-    return day_list[num % 7]
-
-
 class UnknownRoute(Exception):
     """The given route is unknown in the current context"""
     pass
@@ -30,27 +22,6 @@ class UnknownStop(Exception):
     pass
 
 
-class Schedule:
-
-    def __init__(self, route_id: int, timetable: Dict[int, List[datetime]], start_time: datetime, name: str = None):
-        """
-        A paper schedule
-        :param route_id: The route ID that this schedule is valid for
-        :param timetable: The timetable listing the times for each stop ID
-        :param start_time: The earliest time in the schedule's timetable
-        :param name: The name of the schedule
-        """
-        self.route_id = route_id
-        self.start_time = start_time
-        self.timetable = timetable
-        self.name = name
-
-    def __str__(self):
-        # Get the longest timetable length
-        loop_count = max([len(t) for t in self.timetable.values()])
-        return f'{self.name + ":" or ""} {self.route_id}: {len(self.timetable)} columns, {loop_count} loops'
-
-
 class ScheduleManager:
     OLD_DATE = datetime(day=1, month=1, year=1980, tzinfo=pytz.utc)
 
@@ -61,7 +32,6 @@ class ScheduleManager:
         :param schedules_path: The path where the CSVs of the schedules are stored
         :param local_timezone: A string representing the local timezone
         """
-        self._shuttle_data_lock = Lock()
         self._route_data_lock = Lock()
         self._paper_schedules_lock = Lock()
 
@@ -69,9 +39,10 @@ class ScheduleManager:
 
         self._agency_id = agency_id
         self._schedules_path = schedules_path
+        self._calendar = ScheduleCalendar.ScheduleCalendar(schedules_path, local_timezone)
+        self._topology = RouteTopology.RouteTopology({})
         self._last_route_data = self.stops_by_route(update=True)
         self._last_paper_schedules = self.paper_schedules(update=True)
-        self._shuttle_data = {}
 
         routes = ShuttleService.ShuttleService(self._agency_id).get_routes()
         self._known_routes = {route.id: route.long_name for route in routes}
@@ -107,34 +78,45 @@ class ScheduleManager:
             for route in ss.get_routes():
                 latest_route_data[route.id] = [stop_dict[s] for s in stops_by_route[route.id]]
             self._last_route_data = latest_route_data
+            self._topology.update_routes(latest_route_data)
 
         self._route_data_lock.release()
         return self._last_route_data
 
-    def validate_stop(self, shuttle_id: int, stop_id: int) -> bool:
+    def validate_stop(self, shuttle_id: int, stop_id: int, route_id: int = None, arrival_time: datetime = None) -> bool:
         """
-        Check whether the same shuttle was at this stop twice in a row
+        Check whether the same shuttle was at this stop twice in a row, and if not track it at this stop
         :param shuttle_id: The ID of the shuttle to check
         :param stop_id: The stop ID to check for a double-stop
+        :param route_id: The route of the shuttle, used to track its position in the route's stop sequence
+        :param arrival_time: The time the shuttle arrived, used to apply per-stop rules such as the one for Howe Center
         :return: True if the shuttle was not at this stop twice in a row (or more), False otherwise
         """
-        # TODO Save this dictionary to DB on close so that the state can be loaded when the program starts
-        # TODO Custom logic for Howe Center stop
-        self._shuttle_data_lock.acquire()
+        return self._topology.validate(shuttle_id, stop_id, route_id, arrival_time)
 
-        valid = False
-        try:
-            if self._shuttle_data[shuttle_id]['prev_stop'] != stop_id:
-                self._shuttle_data[shuttle_id]['prev_stop'] = stop_id
-                valid = True
-        except KeyError:
-            self._shuttle_data[shuttle_id] = {
-                'prev_stop': stop_id
-            }
-            valid = True
+    def candidate_stops(self, shuttle: ShuttleService.Shuttle) -> List[ShuttleService.Stop]:
+        """
+        Get the stops a shuttle could reach next
+        :param shuttle: The shuttle to check. This should be called once per tick for each shuttle
+        :return: The few stops after the shuttle's last confirmed stop, or every stop on its route if its position is unknown
+        :raise KeyError: if the shuttle's route is unknown
+        """
+        candidates = self._topology.candidates(shuttle)
+        if candidates is None:
+            return self.stops_by_route()[shuttle.route_id]
+        return candidates
+
+    def prune_shuttles(self, before: datetime):
+        """
+        Forget the stop sequence positions of shuttles that were not seen since the given time
+        :param before: The cutoff time
+        :return: None
+        """
+        self._topology.prune(before)
 
-        self._shuttle_data_lock.release()
-        return valid
+    def _schedules_at(self, time: datetime) -> Dict[int, List[Schedule]]:
+        """Get the paper schedules that run on the local date of the given time"""
+        return self._calendar.schedules_on(time.astimezone(self._tz).date())
 
     def get_nearest_time(self, route_id: int, stop_id: int, reported_time: datetime) -> datetime:
         """
@@ -143,15 +125,13 @@ class ScheduleManager:
         :param reported_time: The time to compare to the schedules
         :param stop_id: The stop to get the timetable for
         :return: A datetime representing the time closest to the given time, satisfying the conditions above
-        :raises UnknownRoute: if the route ID could not be found
+        :raises UnknownRoute: if the route ID could not be found in the schedules running on the date of the given time
         :raises UnknownStop: if no timetable for the stop ID could be found
         """
-        self._paper_schedules_lock.acquire()
-        try:
-            schedules = self._last_paper_schedules[route_id]
-        except KeyError:
+        # schedules_on returns a defaultdict, so look the route up without adding it
+        schedules = self._schedules_at(reported_time).get(route_id)
+        if not schedules:
             raise UnknownRoute(f'No schedule associated with route {route_id}')
-        self._paper_schedules_lock.release()
         # Order schedules by start time so that they are searched sequentially
         schedules = sorted(schedules, key=lambda s: s.start_time)
 
@@ -178,6 +158,35 @@ class ScheduleManager:
         # At this point all schedules have been iterated which means the reported time is late to last stop
         return last_end_time
 
+    def get_next_time(self, route_id: int, stop_id: int, after: datetime) -> Optional[datetime]:
+        """
+        Get the first scheduled time at or after the given time for the given route and stop
+        :param route_id: The route to get the stop schedules from
+        :param stop_id: The stop to get the timetable for
+        :param after: The time to search from
+        :return: The next scheduled time, or None if there are no more scheduled times in the schedules running on that date
+        :raises UnknownRoute: if the route ID could not be found
+        :raises UnknownStop: if no timetable for the stop ID could be found
+        """
+        schedules = self._schedules_at(after).get(route_id)
+        if not schedules:
+            raise UnknownRoute(f'No schedule associated with route {route_id}')
+
+        found = False
+        next_time = None
+        for schedule in schedules:
+            stop_times = schedule.timetable.get(stop_id)
+            if not stop_times:
+                continue
+            found = True
+            # Each column of stop times is in ascending order
+            index = bisect_left(stop_times, after)
+            if index < len(stop_times) and (next_time is None or stop_times[index] < next_time):
+                next_time = stop_times[index]
+        if not found:
+            raise UnknownStop(f'Stop ID {stop_id} not found in any schedule for route {route_id}')
+        return next_time
+
     def paper_schedules(self, update: bool = False) -> Dict[int, List[Schedule]]:
         """
         Load paper schedules from the schedule directory
@@ -187,72 +196,21 @@ class ScheduleManager:
 
         self._paper_schedules_lock.acquire()
         if update:
-            now = datetime.now(tz=self._tz)
-            weekday = now.weekday()
-            relevant_dates = {
-                _get_weekday(weekday - 1): (now - timedelta(days=1)).date(),
-                weekday: now.date(),
-            }
-
-            schedules = defaultdict(list)
-            with open(os.path.join(self._schedules_path, 'file_info.json'), 'r') as info_file:
-                all_file_info = json.load(info_file)['file_info']
-                for schedule_filename in [f for f in os.listdir(self._schedules_path) if os.path.splitext(f)[-1] == '.csv']:
-                    file_info = all_file_info[schedule_filename]
-                    # Check if the schedule is valid for any of the relevant days
-                    start_dates = [relevant_dates[day] for day in file_info['valid_days'] if day == weekday]
-                    # Generate a schedule as if it started yesterday if it overlaps with today
-                    overlap_dates = [relevant_dates[_get_weekday(day - 1)] for day in file_info['overlap_days'] if day == weekday]
-                    dates_to_generate = set(start_dates + overlap_dates)
-                    for cur_date in dates_to_generate:
-                        with open(os.path.join(self._schedules_path, schedule_filename)) as schedule_file:
-                            schedule = self._convert_schedule_file(file_info=file_info,
-                                                                   schedule_file=schedule_file,
-                                                                   schedule_name=os.path.splitext(schedule_filename)[0],
-                                                                   start_date=cur_date)
-                            schedules[schedule.route_id].append(schedule)
-            self._last_paper_schedules = schedules
+            self._calendar.reload()
+            self._last_paper_schedules = self._calendar.schedules_on(datetime.now(tz=self._tz).date())
 
         self._paper_schedules_lock.release()
         return self._last_paper_schedules
 
-    def _convert_schedule_file(self, file_info: Dict, schedule_file: TextIO, schedule_name: str, start_date: date) -> Schedule:
-        """
-        Convert a schedule file into a Schedule object
-        :param file_info: The information about the file
-        :param schedule_file: The opened file handle of the schedule
-        :param schedule_name: The name of the schedule
-        :param start_date: The absolute date to use when creating this schedule's stop times
-        :return: A Schedule object representing the paper schedule
-        """
-        data = csv.reader(schedule_file)
-        stops = [int(col) for col in data.__next__()]
-        schedule_cols = {col: [] for col in stops}
-        next_stop_id = cycle(stops)
-
-        last_time = None
-        first_time = None
-        for line in data:
-            for str_time in line:
-                if str_time.lower() == 'none':
-                    next_stop_id.__next__()
-                    continue
-                raw_time = datetime.strptime(str_time, '%I:%M%p').time()
-                # If the current time is in the AM but the last time is in the PM
-                # then midnight was crossed
-                if last_time is not None and raw_time.hour < 12 <= last_time.hour:
-                    start_date += timedelta(days=1)
-                last_time = raw_time
-                stop_time = self._convert_to_utc(datetime.combine(start_date, raw_time))
-                if first_time is None:
-                    first_time = stop_time
-                schedule_cols[next_stop_id.__next__()].append(stop_time)
-
-        return Schedule(file_info['route_id'], schedule_cols, first_time, name=schedule_name)
-
-    def _convert_to_utc(self, time: datetime) -> datetime:
-        """Convert a datetime to UTC"""
-        return self._tz.localize(time).astimezone(pytz.utc)
+    @property
+    def calendar(self) -> ScheduleCalendar.ScheduleCalendar:
+        """The calendar used to materialize paper schedules for any date"""
+        return self._calendar
+
+    @property
+    def topology(self) -> RouteTopology.RouteTopology:
+        """The model of each shuttle's position in its route's stop sequence, which holds the per-stop rules"""
+        return self._topology
 
 
 class SharedScheduleManager(BaseManager):
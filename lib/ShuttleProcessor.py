@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+import threading
+import time
+from typing import Callable, Iterable
+
+import pytz
+
+import EventBus
+import EventLog
+import HeadwayMonitor
+import ScheduleManager
+import ShuttleService
+import StopDetector
+
+
+def process_shuttle(scheduler: ScheduleManager.ScheduleManager, shuttle: ShuttleService.Shuttle,
+                    write: Callable[[int, int, int, datetime, datetime], None], events: EventLog.EventLog,
+                    detector: StopDetector.StopDetector, monitor: HeadwayMonitor.HeadwayMonitor = None, bus: EventBus.EventBus = None):
+    """
+    Detect the stops a shuttle reached since the last tick and record them.
+    This is shared by every engine, which only differ in how confirmed stops are written
+    :param scheduler: The schedule manager of the shuttle's agency
+    :param shuttle: The shuttle to process
+    :param write: Called with the shuttle ID, route ID, stop ID, arrival time and expected time of each confirmed stop
+    :param events: The event log to record detections and errors in
+    :param detector: The stop detector holding the shuttle's recent trajectory
+    :param monitor: An optional headway monitor to record confirmed stops with
+    :param bus: An optional event bus to publish confirmed stops on
+    :return: None
+    """
+    stops_by_route = scheduler.stops_by_route()
+    if shuttle.route_id not in stops_by_route:
+        events.unknown_route(shuttle.id, shuttle.route_id)
+        return
+    segment = detector.update(shuttle)
+    if segment is None:
+        # The feed has nothing newer for this shuttle since the last tick
+        return
+    confirmed = False
+    for stop, arrival_time in detector.crossings(segment, scheduler.candidate_stops(shuttle)):
+        if not scheduler.validate_stop(shuttle.id, stop.id, shuttle.route_id, arrival_time):
+            continue
+        try:
+            nearest_time = scheduler.get_nearest_time(shuttle.route_id, stop.id, arrival_time)
+        except (ScheduleManager.UnknownRoute, ScheduleManager.UnknownStop) as e:
+            events.error(str(e), shuttle_id=shuttle.id, route_id=shuttle.route_id, stop_id=stop.id)
+            return
+        write(shuttle.id, shuttle.route_id, stop.id, arrival_time, nearest_time)
+        events.detection(shuttle.id, shuttle.route_id, stop.id, stop.name, arrival_time, nearest_time)
+        if bus is not None:
+            bus.publish_stop(shuttle, stop, nearest_time, arrival_time)
+        if monitor is not None:
+            for event in monitor.record_arrival(shuttle.id, shuttle.route_id, stop.id, arrival_time):
+                events.headway_event(event)
+        confirmed = True
+    if confirmed or monitor is None:
+        return
+    start = segment.end if segment.start is None else segment.start
+    foreign_stops = monitor.foreign_stops_near(shuttle.route_id, start.position, segment.end.position, detector.box_size)
+    for stop, arrival_time in detector.crossings(segment, foreign_stops):
+        event = monitor.record_foreign_stop(shuttle.id, shuttle.route_id, stop.id, arrival_time)
+        if event is not None:
+            events.headway_event(event)
+        break
+
+
+class Pruner:
+    def __init__(self, detector: StopDetector.StopDetector, max_age: timedelta = timedelta(minutes=10),
+                 every: timedelta = timedelta(minutes=1)):
+        """
+        Forgets the shuttles that left service, so that per-shuttle state does not pile up.
+        Pruning walks the state of every shuttle, so it runs at most once per every instead of every tick
+        :param detector: The stop detector
+        :param max_age: How long a shuttle may go unseen before it is forgotten
+        :param every: The least time between two prunes
+        """
+        self._detector = detector
+        self._max_age = max_age
+        self._every = every.total_seconds()
+        self._lock = threading.Lock()
+        self._last = None
+
+    def prune(self, schedulers: Iterable[ScheduleManager.ScheduleManager]) -> bool:
+        """
+        Prune the detector and the given schedule managers, unless they were pruned recently
+        :param schedulers: The schedule managers of every agency
+        :return: True if they were pruned, False otherwise
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._last is not None and now - self._last < self._every:
+                return False
+            self._last = now
+        before = datetime.now(pytz.utc) - self._max_age
+        self._detector.prune(before)
+        for scheduler in schedulers:
+            scheduler.prune_shuttles(before)
+        return True
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import requests
 import pytz
@@ -39,6 +39,34 @@ class Stop(_GenericDictObj):
             return True
         return False
 
+    def segment_entry(self, start: Tuple[float, float], end: Tuple[float, float], box_size: int) -> Optional[float]:
+        """
+        Find where a straight segment first enters the square of width box_size centered at this stop's position
+        :param start: The start of the segment
+        :param end: The end of the segment
+        :param box_size: The width and height of the box to check in meters
+        :return: The fraction of the way from start to end at which the segment enters the box (0 if start is inside it),
+        or None if the segment never enters the box
+        """
+        # multiply by 0.00001 since 0.00001 is ~1 meter in geographic coordinates
+        width = box_size / 2 * 0.00001
+        t_enter, t_exit = 0.0, 1.0
+        # Clip the segment against each axis of the box in turn
+        for axis in (0, 1):
+            delta = end[axis] - start[axis]
+            low, high = self.position[axis] - width, self.position[axis] + width
+            if delta == 0:
+                if not low <= start[axis] <= high:
+                    return None
+                continue
+            t_low, t_high = (low - start[axis]) / delta, (high - start[axis]) / delta
+            if t_low > t_high:
+                t_low, t_high = t_high, t_low
+            t_enter, t_exit = max(t_enter, t_low), min(t_exit, t_high)
+            if t_enter > t_exit:
+                return None
+        return t_enter
+
     def __str__(self):
         return f'<ID: {self.id}, Name: {self.name}>'
 
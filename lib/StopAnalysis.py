@@ -0,0 +1,124 @@
+import os
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+# The columns stored in every partition, in the order they are written
+COLUMNS = ('shuttle', 'route', 'stop', 'arrival_time', 'expected_time', 'weekday', 'route_name', 'stop_name')
+# Sentinel for a ConfirmedStop row without an expected time
+NO_TIME = np.iinfo(np.int64).min
+
+
+class NoHistory(Exception):
+    """No exported history could be found for the requested range"""
+    pass
+
+
+def partition_filename(day: date) -> str:
+    """Get the filename of the partition for a given service day"""
+    return f'{day.isoformat()}.npz'
+
+
+def write_partition(path: str, day: date, rows: List[Tuple]) -> str:
+    """
+    Write one day of confirmed stops to a compressed columnar file
+    :param path: The directory to write the partition into
+    :param day: The local service day the rows belong to
+    :param rows: Tuples of (shuttle, route, stop, arrival_time, expected_time, weekday, route_name, stop_name),
+    where the times are UTC epoch seconds and expected_time may be None
+    :return: The path of the written partition
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    shuttle, route, stop, arrival_time, expected_time, weekday, route_name, stop_name = columns
+    filename = os.path.join(path, partition_filename(day))
+    np.savez_compressed(filename,
+                        shuttle=np.array(shuttle, dtype=np.int64),
+                        route=np.array(route, dtype=np.int64),
+                        stop=np.array(stop, dtype=np.int64),
+                        arrival_time=np.array(arrival_time, dtype=np.int64),
+                        expected_time=np.array([NO_TIME if t is None else t for t in expected_time], dtype=np.int64),
+                        weekday=np.array(weekday, dtype=np.int8),
+                        route_name=np.array(route_name, dtype=np.str_),
+                        stop_name=np.array(stop_name, dtype=np.str_))
+    return filename
+
+
+def load_history(path: str, start: date = None, end: date = None) -> Dict[str, np.ndarray]:
+    """
+    Load and concatenate exported partitions
+    :param path: The directory containing the partitions
+    :param start: The first day to load (inclusive), or None for no lower bound
+    :param end: The last day to load (inclusive), or None for no upper bound
+    :return: A dictionary mapping each column name to an array
+    :raises NoHistory: if no partition falls within the range
+    """
+    parts = []
+    for filename in sorted(f for f in os.listdir(path) if os.path.splitext(f)[-1] == '.npz'):
+        day = date.fromisoformat(os.path.splitext(filename)[0])
+        if (start is not None and day < start) or (end is not None and day > end):
+            continue
+        with np.load(os.path.join(path, filename)) as part:
+            parts.append({col: part[col] for col in COLUMNS})
+    if not parts:
+        raise NoHistory(f'No history found in {path} between {start} and {end}')
+    return {col: np.concatenate([part[col] for part in parts]) for col in COLUMNS}
+
+
+def lateness(history: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Get the lateness of every stop in seconds
+    :param history: The history as returned by load_history
+    :return: An array of arrival minus expected time, with NaN where no expected time was recorded
+    """
+    late = (history['arrival_time'] - history['expected_time']).astype(np.float64)
+    late[history['expected_time'] == NO_TIME] = np.nan
+    return late
+
+
+def lateness_distribution(history: Dict[str, np.ndarray], bins: Iterable[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get a histogram of the lateness of every stop
+    :param history: The history as returned by load_history
+    :param bins: The bin edges in seconds. Defaults to one-minute bins from 30 minutes early to 30 minutes late
+    :return: A tuple of (counts, bin edges)
+    """
+    if bins is None:
+        bins = np.arange(-30 * 60, 30 * 60 + 1, 60)
+    late = lateness(history)
+    return np.histogram(late[~np.isnan(late)], bins=bins)
+
+
+def stop_percentiles(history: Dict[str, np.ndarray], percentiles: Iterable[float] = (50, 90, 95)) -> Dict[Tuple[int, int], np.ndarray]:
+    """
+    Get lateness percentiles for every (route, stop) pair
+    :param history: The history as returned by load_history
+    :param percentiles: The percentiles to compute
+    :return: A dictionary mapping (route ID, stop ID) to an array of lateness percentiles in seconds
+    """
+    late = lateness(history)
+    known = ~np.isnan(late)
+    route, stop, late = history['route'][known], history['stop'][known], late[known]
+    # Sort by (route, stop) so each pair is a contiguous run, then split the runs apart
+    order = np.lexsort((stop, route))
+    route, stop, late = route[order], stop[order], late[order]
+    keys, starts = np.unique(np.stack((route, stop), axis=1), axis=0, return_index=True)
+    groups = np.split(late, starts[1:])
+    return {(int(r), int(s)): np.percentile(group, list(percentiles)) for (r, s), group in zip(keys, groups)}
+
+
+def day_of_week_profile(history: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the mean lateness for each day of the week
+    :param history: The history as returned by load_history
+    :return: A tuple of (stop counts, mean lateness in seconds), each indexed by weekday, assuming 0 is Monday.
+    The mean is NaN for days without any stops
+    """
+    late = lateness(history)
+    known = ~np.isnan(late)
+    weekday = history['weekday'][known].astype(np.int64)
+    counts = np.bincount(weekday, minlength=7)
+    totals = np.bincount(weekday, weights=late[known], minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts, totals / counts
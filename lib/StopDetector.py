@@ -0,0 +1,96 @@
+from collections import deque
+from datetime import datetime, timedelta
+import threading
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+import pytz
+
+import ShuttleService
+
+
+class Sample(NamedTuple):
+    timestamp: datetime
+    position: Tuple[float, float]
+
+
+class Segment(NamedTuple):
+    """The path of a shuttle between two polls. start is None when there is no usable previous sample"""
+    start: Optional[Sample]
+    end: Sample
+
+
+class StopDetector:
+    def __init__(self, box_size: int = 30, history: int = 8, max_gap: timedelta = timedelta(minutes=2)):
+        """
+        Detects stops from the path a shuttle took between polls instead of only the polled positions,
+        so a shuttle that passes a stop between two polls is still detected
+        :param box_size: The width and height in meters of the box around each stop
+        :param history: The number of recent samples to keep for each shuttle
+        :param max_gap: The longest time between two samples that is still interpolated.
+        Longer gaps fall back to testing only the latest position
+        """
+        self._box_size = box_size
+        self._history = history
+        self._max_gap = max_gap
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._seen = {}
+
+    @property
+    def box_size(self) -> int:
+        return self._box_size
+
+    def samples(self, shuttle_id: int) -> List[Sample]:
+        """Get the recent samples of a shuttle, oldest first"""
+        return list(self._samples.get(shuttle_id, ()))
+
+    def update(self, shuttle: ShuttleService.Shuttle) -> Optional[Segment]:
+        """
+        Add a shuttle's latest sample to its ring buffer
+        :param shuttle: The polled shuttle
+        :return: The segment travelled since the previous sample, or None if the sample is not newer than the previous one
+        """
+        sample = Sample(shuttle.timestamp, shuttle.position)
+        with self._lock:
+            try:
+                samples: Deque[Sample] = self._samples[shuttle.id]
+            except KeyError:
+                samples = self._samples[shuttle.id] = deque(maxlen=self._history)
+            self._seen[shuttle.id] = datetime.now(pytz.utc)
+            previous = samples[-1] if samples else None
+            if previous is not None and sample.timestamp <= previous.timestamp:
+                return None
+            samples.append(sample)
+        if previous is not None and sample.timestamp - previous.timestamp > self._max_gap:
+            previous = None
+        return Segment(previous, sample)
+
+    def crossings(self, segment: Segment, stops: List[ShuttleService.Stop]) -> List[Tuple[ShuttleService.Stop, datetime]]:
+        """
+        Find the stops a segment passes through
+        :param segment: The segment, as returned by update
+        :param stops: The stops to test
+        :return: A list of (stop, interpolated arrival time) tuples, ordered by arrival time
+        """
+        if segment.start is None:
+            return [(stop, segment.end.timestamp) for stop in stops if stop.at_stop(segment.end.position, self._box_size)]
+
+        duration = segment.end.timestamp - segment.start.timestamp
+        found = []
+        for stop in stops:
+            entry = stop.segment_entry(segment.start.position, segment.end.position, self._box_size)
+            if entry is not None:
+                found.append((stop, segment.start.timestamp + duration * entry))
+        found.sort(key=lambda crossing: crossing[1])
+        return found
+
+    def prune(self, before: datetime):
+        """
+        Forget every shuttle that was not polled since the given time.
+        Shuttles whose feed timestamp stopped changing are kept, since they are still in service
+        :param before: The cutoff time, in wall clock time rather than feed time
+        :return: None
+        """
+        with self._lock:
+            self._seen = {shuttle_id: seen for shuttle_id, seen in self._seen.items() if seen >= before}
+            self._samples = {shuttle_id: samples for shuttle_id, samples in self._samples.items() if shuttle_id in self._seen}
@@ -0,0 +1,176 @@
+from collections import deque
+import copy
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+
+class TickStats:
+    def __init__(self):
+        """Counters describing how well a TickScheduler kept its cadence"""
+        self.ticks = 0
+        self.processed = 0
+        self.late = 0
+        self.skipped = 0
+        self.overlaps = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.processed if self.processed else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the counters as a dictionary, suitable for the event log"""
+        return dict(vars(self), mean_lag=self.mean_lag)
+
+    def __str__(self):
+        return (f'{self.ticks} ticks, {self.processed} processed, {self.late} late, {self.skipped} skipped, '
+                f'{self.overlaps} overlaps, lag {self.last_lag:.3f}s (mean {self.mean_lag:.3f}s, max {self.max_lag:.3f}s)')
+
+
+class TickScheduler:
+    DROP = 'drop'
+    CATCH_UP = 'catch_up'
+
+    def __init__(self, interval: float = 1.0, budget: float = None, policy: str = DROP, max_backlog: int = 10,
+                 report: Callable[[TickStats], None] = None, report_every: int = 60):
+        """
+        Runs a fetch and a process step on a fixed cadence.
+        Fetching tick N+1 happens on the calling thread while tick N is processed on a worker thread,
+        and deadlines are absolute so a slow tick never shifts the ticks after it
+        :param interval: The time between ticks in seconds
+        :param budget: The time in seconds from a tick's deadline until it is processed before it is counted as late.
+        Defaults to interval
+        :param policy: What to do when behind. DROP discards stale ticks in favor of the latest one,
+        CATCH_UP processes every tick, keeping at most max_backlog waiting
+        :param max_backlog: The number of ticks that may wait for processing under CATCH_UP
+        :param report: An optional callback, called on the worker thread with a copy of the stats every report_every processed ticks
+        :param report_every: The number of processed ticks between reports. Reports are disabled if it is not positive
+        """
+        if policy not in (TickScheduler.DROP, TickScheduler.CATCH_UP):
+            raise ValueError(f'Unknown policy "{policy}"')
+        if interval <= 0:
+            raise ValueError(f'interval must be positive, not {interval}')
+        self._interval = interval
+        self._budget = interval if budget is None else budget
+        self._policy = policy
+        self._max_backlog = max_backlog
+        self._report = report
+        self._report_every = report_every
+
+        self.stats = TickStats()
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._busy = False
+        self._running = False
+
+    def run(self, fetch: Callable[[], Any], process: Callable[[Any], None], ticks: int = None):
+        """
+        Run ticks until stop() is called or the given number of ticks were fetched
+        :param fetch: Called on the calling thread at every deadline. Its result is passed to process
+        :param process: Called on the worker thread with the result of fetch
+        :param ticks: The number of ticks to run, or None to run until stopped
+        :return: None, once every fetched tick was processed or dropped
+        """
+        self._running = True
+        worker = threading.Thread(target=self._process_loop, args=(process,), daemon=True)
+        worker.start()
+
+        count = 0
+        deadline = time.monotonic()
+        try:
+            while self._running and (ticks is None or count < ticks):
+                now = time.monotonic()
+                if now < deadline:
+                    time.sleep(deadline - now)
+                elif self._policy == TickScheduler.DROP:
+                    # Skip every deadline that already passed so the next fetch is as fresh as possible
+                    missed = int((now - deadline) // self._interval)
+                    if missed:
+                        with self._cond:
+                            self.stats.skipped += missed
+                        deadline += missed * self._interval
+                try:
+                    self._submit(deadline, fetch())
+                except Exception:
+                    logging.exception('Tick fetch failed')
+                    with self._cond:
+                        self.stats.skipped += 1
+                count += 1
+                deadline += self._interval
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify()
+            worker.join()
+
+    def stop(self):
+        """
+        Stop running after the current tick
+        :return: None
+        """
+        self._running = False
+
+    def _submit(self, deadline: float, data: Any):
+        """
+        Hand a fetched tick to the worker thread
+        :param deadline: The deadline of the tick
+        :param data: The result of fetch
+        :return: None
+        """
+        with self._cond:
+            self.stats.ticks += 1
+            if self._busy:
+                self.stats.overlaps += 1
+            if self._policy == TickScheduler.DROP:
+                self.stats.skipped += len(self._queue)
+                self._queue.clear()
+            elif len(self._queue) >= self._max_backlog:
+                self._queue.popleft()
+                self.stats.skipped += 1
+            self._queue.append((deadline, data))
+            self._cond.notify()
+
+    def _process_loop(self, process: Callable[[Any], None]):
+        """
+        Process ticks as they are submitted until the scheduler stops and the queue is empty
+        :param process: The process step
+        :return: None
+        """
+        while True:
+            with self._cond:
+                while not self._queue and self._running:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                deadline, data = self._queue.popleft()
+                self._busy = True
+
+            start = time.monotonic()
+            try:
+                process(data)
+            except Exception:
+                logging.exception('Tick processing failed')
+            latency = time.monotonic() - deadline
+
+            with self._cond:
+                self._busy = False
+                lag = start - deadline
+                self.stats.processed += 1
+                self.stats.last_lag = lag
+                self.stats.max_lag = max(self.stats.max_lag, lag)
+                self.stats.total_lag += lag
+                if latency > self._budget:
+                    self.stats.late += 1
+                report = (self._report is not None and self._report_every > 0
+                          and self.stats.processed % self._report_every == 0)
+                if report:
+                    stats = copy.copy(self.stats)
+            if report:
+                try:
+                    self._report(stats)
+                except Exception:
+                    logging.exception('Tick stats report failed')
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+import json
+
+import pytest
+import pytz
+
+import ArrivalService
+import ScheduleManager
+import ShuttleService
+
+
+class FakeScheduler:
+    STOP = ShuttleService.Stop({'id': 1, 'name': 'Stop', 'position': [40.0, -74.0]})
+    NEXT_TIME = datetime(2018, 10, 15, 12, tzinfo=pytz.utc)
+
+    def __init__(self):
+        self.calls = 0
+
+    def stops_by_route(self):
+        return {10: [FakeScheduler.STOP]}
+
+    def get_next_time(self, route_id, stop_id, after):
+        self.calls += 1
+        return FakeScheduler.NEXT_TIME
+
+
+def make_shuttle(shuttle_id: int, latitude: float, next_stop: int = 1) -> ShuttleService.Shuttle:
+    return ShuttleService.Shuttle({'id': shuttle_id, 'route_id': 10, 'next_stop': next_stop,
+                                   'position': [latitude, -74.0], 'timestamp': 1539604800000})
+
+
+class TestArrivalService:
+    def test_next_arrival(self):
+        arrivals = ArrivalService.ArrivalService(FakeScheduler(), average_speed=10)
+        arrivals.update([make_shuttle(1, 40.001), make_shuttle(2, 40.0005), make_shuttle(3, 40.0, next_stop=2)],
+                        now=FakeScheduler.NEXT_TIME - timedelta(minutes=5))
+
+        response = json.loads(arrivals.next_arrival(10, 1))
+        assert response['scheduled'] == FakeScheduler.NEXT_TIME.isoformat()
+        assert [eta['shuttle'] for eta in response['live']] == [2, 1]
+        assert response['live'][0]['eta_seconds'] == 5
+
+    def test_cache(self):
+        scheduler = FakeScheduler()
+        arrivals = ArrivalService.ArrivalService(scheduler)
+        arrivals.update([])
+
+        first = arrivals.next_arrival(10, 1)
+        assert arrivals.next_arrival(10, 1) is first
+        assert scheduler.calls == 1
+
+        arrivals.update([make_shuttle(1, 40.001)])
+        assert json.loads(arrivals.next_arrival(10, 1))['tick'] == 2
+        assert scheduler.calls == 2
+
+    def test_unknown(self):
+        arrivals = ArrivalService.ArrivalService(FakeScheduler())
+        with pytest.raises(ScheduleManager.UnknownRoute):
+            arrivals.next_arrival(20, 1)
+        with pytest.raises(ScheduleManager.UnknownStop):
+            arrivals.next_arrival(10, 2)
@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+import pytest
+import pytz
+
+import AsyncEngine
+import AsyncShuttleService
+import EventLog
+import ShuttleService
+
+
+STOPS = [{'id': 1, 'name': 'First', 'position': [40.0, -74.0]}, {'id': 2, 'name': 'Second', 'position': [40.01, -74.0]}]
+ROUTES = [{'id': 10, 'long_name': 'Red Line', 'stops': [1, 2]}]
+VEHICLES = [{'id': 100, 'route_id': 10, 'position': [40.0, -74.0], 'timestamp': 1539604800000},
+            {'id': 101, 'route_id': 10, 'position': [40.005, -74.0], 'timestamp': 1539604800000}]
+
+
+class FakeScheduler:
+    NEAREST_TIME = datetime(2018, 10, 15, 12, tzinfo=pytz.utc)
+
+    def stops_by_route(self):
+        return {10: [ShuttleService.Stop(dict(stop)) for stop in STOPS]}
+
+    def candidate_stops(self, shuttle):
+        return self.stops_by_route()[shuttle.route_id]
+
+    def validate_stop(self, shuttle_id, stop_id, route_id=None, arrival_time=None):
+        return True
+
+    def __init__(self):
+        self.prunes = 0
+
+    def prune_shuttles(self, before):
+        self.prunes += 1
+
+    def get_nearest_time(self, route_id, stop_id, reported_time):
+        return FakeScheduler.NEAREST_TIME
+
+    def get_route_name(self, route_id):
+        return 'Red Line'
+
+
+class FakeWriter:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, *row):
+        self.rows.append(row)
+
+
+async def stub_feed(test):
+    async def routes(request):
+        return web.json_response({'routes': ROUTES})
+
+    async def stops(request):
+        if request.query.get('include_routes'):
+            return web.json_response({'routes': ROUTES})
+        return web.json_response({'stops': STOPS})
+
+    async def vehicle_statuses(request):
+        return web.json_response({'vehicles': VEHICLES})
+
+    app = web.Application()
+    app.router.add_get('/routes', routes)
+    app.router.add_get('/stops', stops)
+    app.router.add_get('/vehicle_statuses', vehicle_statuses)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        await test(f'http://127.0.0.1:{port}/')
+    finally:
+        await runner.cleanup()
+
+
+class TestAsyncShuttleService:
+    def test_endpoints(self):
+        async def test(base_url):
+            async with aiohttp.ClientSession() as session:
+                ss = AsyncShuttleService.AsyncShuttleService(307, session, base_url=base_url)
+                assert [route.id for route in await ss.get_routes()] == [10]
+                assert (await ss.get_stop(2)).name == 'Second'
+                assert await ss.get_stop_ids_for_route(10) == [1, 2]
+                shuttle = await ss.get_shuttle_status(101)
+                assert shuttle.position == (40.005, -74.0)
+                with pytest.raises(ShuttleService.ObjectNotFound):
+                    await ss.get_stop(3)
+
+        asyncio.run(stub_feed(test))
+
+
+class TestAsyncEngine:
+    def test_run(self, tmp_path):
+        writer = FakeWriter()
+        events = EventLog.EventLog(str(tmp_path / 'events.jsonl'))
+        seen = []
+        reports = []
+        scheduler = FakeScheduler()
+
+        async def test(base_url):
+            engine = AsyncEngine.AsyncEngine({307: scheduler}, writer, events, interval=0.01, base_url=base_url,
+                                             on_shuttles=lambda agency_id, shuttles: seen.append((agency_id, len(shuttles))),
+                                             report=reports.append, report_every=1)
+            await engine.run(ticks=2)
+            assert engine.stats.ticks == 2
+            assert [stats.processed for stats in reports] == [1, 2]
+            # Pruning is rate limited, so it only ran on the first tick
+            assert scheduler.prunes == 1
+
+        asyncio.run(stub_feed(test))
+        events.close()
+        assert seen == [(307, 2), (307, 2)]
+        # Only shuttle 100 is at a stop, and the second poll has no newer position for it
+        assert [row[:3] for row in writer.rows] == [(100, 10, 1)]
+        assert writer.rows[0][4] == FakeScheduler.NEAREST_TIME
+        with open(str(tmp_path / 'events.jsonl')) as events_file:
+            assert events_file.read().count('"type":"detection"') == 1
+
+    def test_invalid_interval(self, tmp_path):
+        events = EventLog.EventLog(str(tmp_path / 'events.jsonl'))
+        with pytest.raises(ValueError):
+            AsyncEngine.AsyncEngine({307: FakeScheduler()}, FakeWriter(), events, interval=0)
+        events.close()
+
+
+class TestAsyncStopWriter:
+    def test_unexpected_error(self):
+        class BrokenPool:
+            def acquire(self):
+                raise RuntimeError('connection is closed')
+
+        async def test():
+            writer = AsyncEngine.AsyncStopWriter(BrokenPool())
+            writer.start()
+            writer.write(100, 10, 1, None, None)
+            await asyncio.wait_for(writer._queue.join(), timeout=1)
+            # The writer survives the error, so later rows are still taken and close() returns
+            writer.write(100, 10, 2, None, None)
+            await asyncio.wait_for(writer.close(), timeout=1)
+
+        asyncio.run(test())
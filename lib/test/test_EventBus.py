@@ -0,0 +1,66 @@
+from datetime import datetime
+import json
+from urllib.request import urlopen
+
+import pytz
+
+import EventBus
+import ShuttleService
+
+
+class TestEventBus:
+    def test_publish(self):
+        bus = EventBus.EventBus()
+        everything = bus.subscribe()
+        stops = bus.subscribe(['stops'])
+        bus.publish('positions', [1])
+        bus.publish('stops', {'time': datetime(2018, 10, 15, tzinfo=pytz.utc)})
+
+        assert everything.get(timeout=0) == [('positions', b'[1]'), ('stops', b'{"time":"2018-10-15T00:00:00+00:00"}')]
+        assert [topic for topic, frame in stops.get(timeout=0)] == ['stops']
+        assert stops.get(timeout=0) == []
+
+        bus.unsubscribe(stops)
+        assert bus.subscriber_count == 1
+
+    def test_slow_subscribers(self):
+        bus = EventBus.EventBus(max_buffer=2)
+        subscription = bus.subscribe()
+        for i in range(5):
+            bus.publish('positions', i)
+        assert subscription.dropped == 3
+        assert subscription.get(timeout=0) == [('positions', b'3'), ('positions', b'4')]
+
+        bus = EventBus.EventBus(max_buffer=2, disconnect_slow=True)
+        subscription = bus.subscribe()
+        for i in range(3):
+            bus.publish('positions', i)
+        assert subscription.closed
+        assert subscription.get(timeout=0) == []
+        bus.publish('positions', 3)
+        assert bus.subscriber_count == 0
+
+    def test_stream(self):
+        bus = EventBus.EventBus()
+        server = EventBus.serve(bus, port=0, heartbeat=0.05)
+        try:
+            host, port = server.server_address
+            with urlopen(f'http://{host}:{port}/events?topics=stops', timeout=5) as stream:
+                assert stream.readline() == b': heartbeat\n'
+                stream.readline()
+
+                shuttle = ShuttleService.Shuttle({'id': 1, 'route_id': 10, 'position': [40.0, -74.0], 'timestamp': 1539604800000})
+                stop = ShuttleService.Stop({'id': 100, 'name': 'First', 'position': [40.0, -74.0]})
+                bus.publish_positions([shuttle])
+                bus.publish_stop(shuttle, stop, None)
+
+                line = stream.readline()
+                while line == b': heartbeat\n' or line == b'\n':
+                    line = stream.readline()
+                assert line == b'event: stops\n'
+                data = json.loads(stream.readline()[len(b'data: '):])
+                assert data['stop_name'] == 'First'
+                assert data['arrival_time'] == '2018-10-15T12:00:00+00:00'
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,42 @@
+from datetime import datetime
+import gzip
+import json
+import os
+
+import pytz
+
+import EventLog
+import HeadwayMonitor
+
+
+class TestEventLog:
+    def test_record(self, tmp_path):
+        path = str(tmp_path / 'events.jsonl')
+        events = EventLog.EventLog(path, route_name=lambda route_id: {10: 'Red Line'}[route_id])
+        arrival = datetime(2018, 10, 15, 12, tzinfo=pytz.utc)
+        events.detection(1, 10, 100, 'First', arrival, None)
+        events.unknown_route(2, 20)
+        events.error('Stop 100 not found', route_id=10)
+        events.headway_event(HeadwayMonitor.RouteSubstitution(1, 10, 100, (20,), arrival))
+        events.close()
+
+        with open(path) as events_file:
+            records = [json.loads(line) for line in events_file]
+        assert [record['type'] for record in records] == ['detection', 'unknown_route', 'error', 'route_substitution']
+        assert records[0]['arrival_time'] == arrival.isoformat()
+        assert records[0]['expected_time'] is None
+        assert records[0]['route_name'] == 'Red Line'
+        assert records[1]['route_name'] is None
+        assert records[3]['serving_routes'] == [20]
+        assert all('time' in record for record in records)
+
+    def test_rotation(self, tmp_path):
+        path = str(tmp_path / 'events.jsonl')
+        events = EventLog.EventLog(path, max_bytes=200, backup_count=2)
+        for i in range(20):
+            events.error('rotate', index=i)
+        events.close()
+
+        assert sorted(os.listdir(str(tmp_path))) == ['events.jsonl', 'events.jsonl.1.gz', 'events.jsonl.2.gz']
+        with gzip.open(path + '.1.gz', 'rt') as rotated_file:
+            assert json.loads(rotated_file.readline())['message'] == 'rotate'
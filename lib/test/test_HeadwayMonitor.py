@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+import HeadwayMonitor
+import ShuttleService
+
+
+def make_stop(stop_id: int) -> ShuttleService.Stop:
+    return ShuttleService.Stop({'id': stop_id, 'name': str(stop_id), 'position': [40.0, -74.0 + stop_id * 0.001]})
+
+
+class TestHeadwayMonitor:
+    START = datetime(2018, 10, 15, 12, tzinfo=pytz.utc)
+    STOPS_BY_ROUTE = {10: [make_stop(1), make_stop(2)], 20: [make_stop(2), make_stop(3)]}
+
+    def test_headway_stats(self):
+        stats = HeadwayMonitor.HeadwayStats(window=3)
+        for headway in [100, 200, 300, 400]:
+            stats.add(headway)
+        assert list(stats.headways) == [200, 300, 400]
+        assert stats.mean == 300
+        assert abs(stats.stdev - (20000 / 3) ** 0.5) < 1e-9
+
+    def test_bunching(self):
+        monitor = HeadwayMonitor.HeadwayMonitor(TestHeadwayMonitor.STOPS_BY_ROUTE, min_samples=3)
+        for i in range(4):
+            assert monitor.record_arrival(i, 10, 1, TestHeadwayMonitor.START + timedelta(minutes=10 * i)) == []
+
+        events = monitor.record_arrival(4, 10, 1, TestHeadwayMonitor.START + timedelta(minutes=31))
+        assert len(events) == 1
+        assert events[0].leader_id == 3
+        assert events[0].headway == 60
+        assert events[0].mean_headway == 600
+
+        # Out of order arrivals do not produce headways
+        assert monitor.record_arrival(5, 10, 1, TestHeadwayMonitor.START) == []
+        assert monitor.stats(10, 1).count == 4
+
+    def test_route_substitution(self):
+        monitor = HeadwayMonitor.HeadwayMonitor(TestHeadwayMonitor.STOPS_BY_ROUTE)
+        assert [stop.id for stop in monitor.foreign_stops(10)] == [3]
+        assert [stop.id for stop in monitor.foreign_stops(20)] == [1]
+        # Stop 3 is at (40.0, -73.997), and only the grid cells around the segment are searched
+        assert [stop.id for stop in monitor.foreign_stops_near(10, (40.0, -73.9975), (40.0, -73.9965), 30)] == [3]
+        assert monitor.foreign_stops_near(10, (40.01, -73.997), (40.01, -73.996), 30) == []
+        assert monitor.foreign_stops_near(20, (40.0, -73.9975), (40.0, -73.9965), 30) == []
+
+        event = monitor.record_foreign_stop(1, 10, 3, TestHeadwayMonitor.START)
+        assert event.serving_routes == (20,)
+        assert monitor.record_foreign_stop(1, 10, 3, TestHeadwayMonitor.START) is None
+
+        monitor.record_arrival(1, 10, 1, TestHeadwayMonitor.START)
+        assert monitor.record_foreign_stop(1, 10, 3, TestHeadwayMonitor.START) is not None
@@ -0,0 +1,119 @@
+import json
+import os
+import pstats
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+import Profiler
+
+
+class Instrumented:
+    def work(self, value):
+        return value * 2
+
+    def _private(self):
+        return None
+
+
+class TestProfiler:
+    def test_call_timer(self):
+        timer = Profiler.CallTimer(sample_every=2)
+        timer.instrument(Instrumented)
+        # Instrumenting twice does not wrap twice
+        timer.instrument(Instrumented)
+        assert getattr(Instrumented._private, '_call_timer', None) is None
+
+        for i in range(10):
+            assert Instrumented().work(i) == i * 2
+        timings = timer.timings()
+        assert list(timings) == ['Instrumented.work']
+        assert timings['Instrumented.work']['samples'] == 5
+
+    def test_call_timer_sample_every(self):
+        with pytest.raises(ValueError):
+            Profiler.CallTimer(sample_every=0)
+
+    def test_signal_while_locked(self, tmp_path):
+        profiler = Profiler.TickProfiler(str(tmp_path))
+        previous = signal.getsignal(signal.SIGUSR1)
+        profiler.install_signal_handlers(ticks=3)
+        try:
+            # The handler runs on this thread, so it must not wait for the lock this thread holds
+            with profiler._lock:
+                os.kill(os.getpid(), signal.SIGUSR1)
+                time.sleep(0.01)
+            assert profiler._request == (3, Profiler.TickProfiler.CPROFILE)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_cprofile(self, tmp_path):
+        timer = Profiler.CallTimer(sample_every=1)
+        profiler = Profiler.TickProfiler(str(tmp_path), call_timer=timer)
+        profiler.request(2)
+        assert profiler.status() == 'idle'
+
+        for _ in range(3):
+            with profiler.tick():
+                sum(range(1000))
+            if profiler.status() != 'idle':
+                assert profiler.status() == 'cprofile, 1 ticks remaining'
+
+        files = sorted(os.listdir(str(tmp_path)))
+        assert [os.path.splitext(f)[-1] for f in files] == ['.prof', '.json']
+        pstats.Stats(os.path.join(str(tmp_path), files[0]))
+        with open(os.path.join(str(tmp_path), files[1])) as timings_file:
+            assert isinstance(json.load(timings_file), dict)
+
+    def test_cprofile_threads(self, tmp_path):
+        profiler = Profiler.TickProfiler(str(tmp_path))
+
+        def busy_work():
+            return sum(range(10000))
+
+        def worker():
+            with profiler.profiled():
+                busy_work()
+
+        # Nothing is profiled outside a session
+        worker()
+        profiler.request(1)
+        with profiler.tick():
+            threads = [threading.Thread(target=worker) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        files = os.listdir(str(tmp_path))
+        stats = pstats.Stats(os.path.join(str(tmp_path), files[0]))
+        calls = {function[2]: stat[1] for function, stat in stats.stats.items()}
+        assert calls['busy_work'] == 3
+
+    def test_sampling(self, tmp_path):
+        profiler = Profiler.TickProfiler(str(tmp_path), sample_interval=0.001)
+        profiler.request(1, Profiler.TickProfiler.SAMPLING)
+        with profiler.tick():
+            time.sleep(0.05)
+        files = os.listdir(str(tmp_path))
+        assert len(files) == 1 and files[0].endswith('.stacks')
+        with open(os.path.join(str(tmp_path), files[0])) as stacks_file:
+            assert 'test_sampling' in stacks_file.read()
+
+    def test_control_socket(self, tmp_path):
+        profiler = Profiler.TickProfiler(str(tmp_path))
+        server = profiler.serve(port=0)
+        try:
+            with socket.create_connection(server.server_address) as conn:
+                conn_file = conn.makefile('rwb')
+                for command, response in [('start 5 sampling', 'ok'), ('start 5 unknown', 'error: Unknown profiling mode "unknown"'),
+                                          ('stop', 'ok'), ('status', 'idle'), ('restart', 'error: unknown command "restart"')]:
+                    conn_file.write(f'{command}\n'.encode())
+                    conn_file.flush()
+                    assert conn_file.readline().decode().strip() == response
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+import RouteTopology
+import ShuttleService
+import StopDetector
+
+
+def make_stop(stop_id: int) -> ShuttleService.Stop:
+    return ShuttleService.Stop({'id': stop_id, 'name': str(stop_id), 'position': [40.0, -74.0 + stop_id * 0.001]})
+
+
+def make_shuttle(next_stop: int = None, route_id: int = 10, shuttle_id: int = 1) -> ShuttleService.Shuttle:
+    return ShuttleService.Shuttle({'id': shuttle_id, 'route_id': route_id, 'next_stop': next_stop, 'position': [40.0, -74.0],
+                                   'timestamp': 1539604800000})
+
+
+def ids(stops):
+    return None if stops is None else [stop.id for stop in stops]
+
+
+class TestRouteTopology:
+    START = datetime(2018, 10, 15, 12, tzinfo=pytz.utc)
+    # A loop that starts and ends at stop 1
+    STOPS_BY_ROUTE = {10: [make_stop(stop_id) for stop_id in [1, 2, 3, 4, 5, 6, 1]]}
+
+    def test_candidates(self):
+        topology = RouteTopology.RouteTopology(TestRouteTopology.STOPS_BY_ROUTE, lookahead=3)
+        # Nothing is known about the shuttle yet
+        assert topology.candidates(make_shuttle()) is None
+        # The feed's next stop anchors the window, starting at the stop that may have just been passed
+        assert ids(topology.candidates(make_shuttle(next_stop=4))) == [3, 4, 5]
+
+        assert topology.validate(1, 3, 10)
+        assert ids(topology.candidates(make_shuttle(next_stop=4))) == [4, 5, 6]
+        assert topology.validate(1, 6, 10)
+        assert ids(topology.candidates(make_shuttle())) == [1, 2]
+        # Every stop up to the feed's next stop may have been passed since the last confirmed stop
+        assert ids(topology.candidates(make_shuttle(next_stop=5))) == [1, 2, 3, 4, 5]
+        # Unknown routes are always fully scanned
+        assert topology.candidates(make_shuttle(route_id=20)) is None
+
+    def test_long_segment(self):
+        # Stops about 85 meters apart, so a 40 second gap between polls crosses several of them
+        stops_by_route = {10: [make_stop(stop_id) for stop_id in range(1, 11)]}
+        topology = RouteTopology.RouteTopology(stops_by_route, lookahead=3)
+        detector = StopDetector.StopDetector(box_size=30)
+        assert topology.validate(1, 1, 10)
+
+        detector.update(ShuttleService.Shuttle({'id': 1, 'route_id': 10, 'next_stop': 2, 'position': [40.0, -73.9985],
+                                                'timestamp': 1539604800000}))
+        shuttle = ShuttleService.Shuttle({'id': 1, 'route_id': 10, 'next_stop': 7, 'position': [40.0, -73.9935],
+                                          'timestamp': 1539604840000})
+        segment = detector.update(shuttle)
+        assert ids(stop for stop, _ in detector.crossings(segment, stops_by_route[10])) == [2, 3, 4, 5, 6]
+        assert ids(stop for stop, _ in detector.crossings(segment, topology.candidates(shuttle))) == [2, 3, 4, 5, 6]
+
+    def test_rescan(self):
+        topology = RouteTopology.RouteTopology(TestRouteTopology.STOPS_BY_ROUTE, rescan_after=2)
+        assert topology.validate(1, 2, 10)
+        assert topology.candidates(make_shuttle()) is not None
+        assert topology.candidates(make_shuttle()) is not None
+        assert topology.candidates(make_shuttle()) is None
+        assert topology.candidates(make_shuttle()) is not None
+
+    def test_validate(self):
+        topology = RouteTopology.RouteTopology(TestRouteTopology.STOPS_BY_ROUTE)
+        assert topology.validate(1, 1)
+        assert not topology.validate(1, 1)
+        assert topology.validate(2, 1)
+        assert topology.validate(2, 2)
+
+    def test_terminal_rule(self):
+        topology = RouteTopology.RouteTopology(TestRouteTopology.STOPS_BY_ROUTE,
+                                               rules={1: RouteTopology.Terminal(min_away=timedelta(minutes=5))})
+        assert topology.validate(1, 1, 10, TestRouteTopology.START)
+        # Laying over at the terminal keeps the shuttle seen there
+        for minute in range(1, 10):
+            assert not topology.validate(1, 1, 10, TestRouteTopology.START + timedelta(minutes=minute))
+        # Back after a loop on which no other stop was confirmed
+        assert topology.validate(1, 1, 10, TestRouteTopology.START + timedelta(minutes=20))
+
+        # Other stops still reject repeats
+        assert topology.validate(1, 2, 10, TestRouteTopology.START + timedelta(minutes=21))
+        assert not topology.validate(1, 2, 10, TestRouteTopology.START + timedelta(minutes=40))
+
+    def test_prune(self):
+        topology = RouteTopology.RouteTopology(TestRouteTopology.STOPS_BY_ROUTE)
+        topology.candidates(make_shuttle(next_stop=4))
+        assert topology.validate(2, 3, 10, TestRouteTopology.START)
+        # Pruning goes by when a shuttle was processed, not by its feed timestamp
+        topology.prune(datetime.now(pytz.utc) - timedelta(minutes=1))
+        assert sorted(topology._vehicles) == [1, 2]
+        topology.prune(datetime.now(pytz.utc) + timedelta(seconds=1))
+        assert topology._vehicles == {}
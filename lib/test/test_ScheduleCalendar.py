@@ -0,0 +1,77 @@
+from datetime import date, datetime
+import json
+import os
+
+import pytest
+import pytz
+
+import ScheduleCalendar
+
+
+def write_schedule(path, name: str, rows: list, **info):
+    with open(os.path.join(path, f'{name}.csv'), 'w') as schedule_file:
+        print('1,2', file=schedule_file)
+        for row in rows:
+            print(*row, sep=',', file=schedule_file)
+    try:
+        with open(os.path.join(path, 'file_info.json')) as info_file:
+            all_file_info = json.load(info_file)
+    except FileNotFoundError:
+        all_file_info = {'file_info': {}}
+    all_file_info['file_info'][f'{name}.csv'] = dict(info, filename=name)
+    with open(os.path.join(path, 'file_info.json'), 'w') as info_file:
+        json.dump(all_file_info, info_file)
+
+
+class TestScheduleCalendar:
+    @pytest.fixture
+    def calendar(self, tmp_path):
+        path = str(tmp_path)
+        # Saturday and Sunday nights into the next morning
+        write_schedule(path, 'night', [['11:30PM', '11:45PM'], ['01:30AM', '02:30AM']],
+                       route_id=10, valid_days=[5, 6], overlap_days=[6, 0])
+        write_schedule(path, 'old_day', [['None', '09:00AM']],
+                       route_id=20, valid_days=[0, 1, 2, 3, 4, 5, 6], overlap_days=[], effective_until='2018-12-31')
+        write_schedule(path, 'new_day', [['None', '10:00AM']],
+                       route_id=20, valid_days=[0, 1, 2, 3, 4, 5, 6], overlap_days=[], effective_from='2019-01-01')
+        return ScheduleCalendar.ScheduleCalendar(path, 'America/New_York', cache_size=2)
+
+    def test_schedules_on(self, calendar):
+        # Monday, 10/15/18
+        schedules = calendar.schedules_on(date(2018, 10, 15))
+        night = schedules[10][0]
+        assert night.start_time == datetime(2018, 10, 15, 3, 30, tzinfo=pytz.utc)
+        assert night.timetable[2][-1] == datetime(2018, 10, 15, 6, 30, tzinfo=pytz.utc)
+        assert [s.name for s in schedules[20]] == ['old_day']
+
+        assert 10 not in calendar.schedules_on(date(2018, 10, 16))
+
+    def test_effective_dates(self, calendar):
+        schedules = calendar.schedules_on(date(2019, 1, 1))
+        assert [s.name for s in schedules[20]] == ['new_day']
+        assert schedules[20][0].timetable[1] == []
+        assert schedules[20][0].timetable[2] == [datetime(2019, 1, 1, 15, tzinfo=pytz.utc)]
+
+    def test_dst(self, calendar):
+        # Fall back on Sunday 11/4/18: 01:30AM happens twice, and the standard time is used
+        night = calendar.schedules_on(date(2018, 11, 3))[10][0]
+        assert night.start_time == datetime(2018, 11, 4, 3, 30, tzinfo=pytz.utc)
+        assert night.timetable[1][-1] == datetime(2018, 11, 4, 6, 30, tzinfo=pytz.utc)
+        # Spring forward on Sunday 3/10/19: 02:30AM does not exist and is moved forward an hour
+        night = calendar.schedules_on(date(2019, 3, 9))[10][0]
+        assert night.timetable[1][-1] == datetime(2019, 3, 10, 6, 30, tzinfo=pytz.utc)
+        assert night.timetable[2][-1] == datetime(2019, 3, 10, 7, 30, tzinfo=pytz.utc)
+
+    def test_schedules_between(self, calendar):
+        schedules = calendar.schedules_between(date(2018, 10, 14), date(2018, 10, 16))
+        # Saturday night overlaps into the range
+        assert len(schedules[10]) == 2
+        assert len(schedules[20]) == 3
+        assert schedules[20] == sorted(schedules[20], key=lambda s: s.start_time)
+
+    def test_cache(self, calendar):
+        first = calendar.schedules_starting(date(2018, 10, 15))
+        assert calendar.schedules_starting(date(2018, 10, 15)) is first
+        calendar.schedules_starting(date(2018, 10, 16))
+        calendar.schedules_starting(date(2018, 10, 17))
+        assert calendar.schedules_starting(date(2018, 10, 15)) is not first
@@ -1,16 +1,58 @@
+from datetime import date, datetime
+import json
+from multiprocessing import Lock
 import os
 
 import pytest
+import pytz
 
+import ScheduleCalendar
 import ShuttleService
 import ScheduleManager
 
 
-pytest.skip('Need to integrate gen_schedules.py', allow_module_level=True)
+class TestScheduleLookups:
+    @pytest.fixture
+    def sm(self, tmp_path):
+        path = str(tmp_path)
+        # Monday evenings only
+        with open(os.path.join(path, 'evening.csv'), 'w') as schedule_file:
+            print('1,2', '08:00PM,08:10PM', '09:00PM,09:10PM', sep='\n', file=schedule_file)
+        with open(os.path.join(path, 'file_info.json'), 'w') as info_file:
+            json.dump({'file_info': {'evening.csv': {'filename': 'evening', 'route_id': 10, 'valid_days': [0], 'overlap_days': []}}},
+                      info_file)
+        # Skip __init__, which fetches routes and stops from the feed
+        sm = ScheduleManager.ScheduleManager.__new__(ScheduleManager.ScheduleManager)
+        sm._tz = pytz.timezone('America/New_York')
+        sm._paper_schedules_lock = Lock()
+        sm._calendar = ScheduleCalendar.ScheduleCalendar(path, 'America/New_York')
+        sm._last_paper_schedules = sm._calendar.schedules_on(date(2018, 10, 15))
+        return sm
+
+    def test_lookups_use_the_date_of_the_time(self, sm):
+        # Monday 10/15/18 at 8:58PM local
+        assert sm.get_nearest_time(10, 1, datetime(2018, 10, 16, 0, 58, tzinfo=pytz.utc)) == datetime(2018, 10, 16, 1, tzinfo=pytz.utc)
+        assert sm.get_next_time(10, 2, datetime(2018, 10, 16, 0, 58, tzinfo=pytz.utc)) == datetime(2018, 10, 16, 1, 10, tzinfo=pytz.utc)
+        # Past midnight it is Tuesday, which has no schedule, even though Monday's schedules were loaded
+        with pytest.raises(ScheduleManager.UnknownRoute):
+            sm.get_nearest_time(10, 1, datetime(2018, 10, 16, 4, 30, tzinfo=pytz.utc))
+
+    def test_unknown_route_releases_lock(self, sm):
+        for _ in range(2):
+            with pytest.raises(ScheduleManager.UnknownRoute):
+                sm.get_nearest_time(20, 1, datetime(2018, 10, 15, 12, tzinfo=pytz.utc))
+        with pytest.raises(ScheduleManager.UnknownRoute):
+            sm.get_next_time(20, 1, datetime(2018, 10, 15, 12, tzinfo=pytz.utc))
+        assert sm._paper_schedules_lock.acquire(timeout=1)
+        sm._paper_schedules_lock.release()
+        assert sm.paper_schedules() is sm._last_paper_schedules
 
 
+@pytest.mark.skip(reason='Need to integrate gen_schedules.py')
 class TestScheduleManager:
-    sm = ScheduleManager.ScheduleManager(307, os.path.join(os.getcwd(), 'schedules', 'generated'), 'America/New_York')
+    @classmethod
+    def setup_class(cls):
+        cls.sm = ScheduleManager.ScheduleManager(307, os.path.join(os.getcwd(), 'schedules', 'generated'), 'America/New_York')
 
     def test_get_route_name(self):
         ss = ShuttleService.ShuttleService(307)
@@ -0,0 +1,55 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import StopAnalysis
+
+
+class TestStopAnalysis:
+    # (shuttle, route, stop, arrival_time, expected_time, weekday, route_name, stop_name)
+    DAY_ONE = [(1, 10, 100, 1000, 940, 0, 'Red', 'A'),
+               (1, 10, 101, 2000, 2000, 0, 'Red', 'B'),
+               (2, 10, 100, 3000, None, 0, 'Red', 'A')]
+    DAY_TWO = [(1, 10, 100, 90000, 90120, 1, 'Red', 'A'),
+               (3, 20, 100, 91000, 90880, 1, 'Gray', 'A')]
+
+    @pytest.fixture
+    def history_path(self, tmp_path):
+        StopAnalysis.write_partition(str(tmp_path), date(2018, 10, 15), TestStopAnalysis.DAY_ONE)
+        StopAnalysis.write_partition(str(tmp_path), date(2018, 10, 16), TestStopAnalysis.DAY_TWO)
+        return str(tmp_path)
+
+    def test_load_history(self, history_path):
+        history = StopAnalysis.load_history(history_path)
+        assert len(history['shuttle']) == 5
+        assert list(history['stop_name']) == ['A', 'B', 'A', 'A', 'A']
+
+        history = StopAnalysis.load_history(history_path, start=date(2018, 10, 16))
+        assert list(history['shuttle']) == [1, 3]
+
+        with pytest.raises(StopAnalysis.NoHistory):
+            StopAnalysis.load_history(history_path, end=date(2018, 10, 1))
+
+    def test_lateness(self, history_path):
+        late = StopAnalysis.lateness(StopAnalysis.load_history(history_path))
+        assert np.isnan(late[2])
+        assert list(late[[0, 1, 3, 4]]) == [60, 0, -120, 120]
+
+    def test_lateness_distribution(self, history_path):
+        counts, edges = StopAnalysis.lateness_distribution(StopAnalysis.load_history(history_path))
+        assert counts.sum() == 4
+        assert len(edges) == len(counts) + 1
+
+    def test_stop_percentiles(self, history_path):
+        percentiles = StopAnalysis.stop_percentiles(StopAnalysis.load_history(history_path), percentiles=(0, 100))
+        assert set(percentiles) == {(10, 100), (10, 101), (20, 100)}
+        assert list(percentiles[(10, 100)]) == [-120, 60]
+        assert list(percentiles[(20, 100)]) == [120, 120]
+
+    def test_day_of_week_profile(self, history_path):
+        counts, means = StopAnalysis.day_of_week_profile(StopAnalysis.load_history(history_path))
+        assert list(counts) == [2, 2, 0, 0, 0, 0, 0]
+        assert means[0] == 30
+        assert means[1] == 0
+        assert np.isnan(means[6])
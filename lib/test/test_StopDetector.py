@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+import ShuttleService
+import StopDetector
+
+
+START = 1539604800000
+
+
+def make_stop(stop_id: int, latitude: float) -> ShuttleService.Stop:
+    return ShuttleService.Stop({'id': stop_id, 'name': str(stop_id), 'position': [latitude, -74.0]})
+
+
+def make_shuttle(latitude: float, timestamp: int, shuttle_id: int = 1) -> ShuttleService.Shuttle:
+    return ShuttleService.Shuttle({'id': shuttle_id, 'route_id': 10, 'position': [latitude, -74.0], 'timestamp': timestamp})
+
+
+class TestStopDetector:
+    STOPS = [make_stop(1, 40.001), make_stop(2, 40.003), make_stop(3, 40.01)]
+
+    def test_segment_entry(self):
+        stop = make_stop(1, 40.001)
+        # The 30 meter box spans 40.00085 to 40.00115
+        assert abs(stop.segment_entry((40.0, -74.0), (40.002, -74.0), 30) - 0.425) < 1e-9
+        assert stop.segment_entry((40.001, -74.0), (40.002, -74.0), 30) == 0
+        assert stop.segment_entry((40.0, -74.0), (40.0005, -74.0), 30) is None
+        # Passing beside the box
+        assert stop.segment_entry((40.0, -73.999), (40.002, -73.999), 30) is None
+
+    def test_crossings_between_polls(self):
+        detector = StopDetector.StopDetector()
+        assert detector.crossings(detector.update(make_shuttle(40.0, START)), TestStopDetector.STOPS) == []
+
+        # Neither poll is near a stop, but the shuttle drove through two of them in between
+        crossings = detector.crossings(detector.update(make_shuttle(40.004, START + 40000)), TestStopDetector.STOPS)
+        assert [stop.id for stop, _ in crossings] == [1, 2]
+        start = datetime.fromtimestamp(START / 1000, tz=pytz.utc)
+        assert crossings[0][1] == start + timedelta(seconds=8.5)
+        assert crossings[1][1] == start + timedelta(seconds=28.5)
+
+    def test_stale_and_long_gaps(self):
+        detector = StopDetector.StopDetector(history=2, max_gap=timedelta(minutes=2))
+        detector.update(make_shuttle(40.0, START))
+        # The feed has not updated the shuttle
+        assert detector.update(make_shuttle(40.0, START)) is None
+
+        # Too long since the previous sample to interpolate, so only the latest position counts
+        segment = detector.update(make_shuttle(40.004, START + 180000))
+        assert segment.start is None
+        assert detector.crossings(segment, TestStopDetector.STOPS) == []
+        segment = detector.update(make_shuttle(40.01, START + 190000))
+        assert [stop.id for stop, _ in detector.crossings(segment, TestStopDetector.STOPS)] == [3]
+        assert [sample.position for sample in detector.samples(1)] == [(40.004, -74.0), (40.01, -74.0)]
+
+        # Pruning goes by when a shuttle was polled, not by its feed timestamp
+        detector.prune(datetime.now(pytz.utc) - timedelta(minutes=1))
+        assert len(detector.samples(1)) == 2
+        detector.prune(datetime.now(pytz.utc) + timedelta(seconds=1))
+        assert detector.samples(1) == []
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import TickScheduler
+
+
+class TestTickScheduler:
+    def test_cadence(self):
+        processed = []
+        ticks = TickScheduler.TickScheduler(interval=0.01)
+        ticks.run(lambda: len(processed), processed.append, ticks=5)
+        assert len(processed) == 5
+        assert ticks.stats.ticks == 5
+        assert ticks.stats.skipped == 0
+
+    def test_drop(self):
+        processed = []
+
+        def process(data):
+            processed.append(data)
+            time.sleep(0.05)
+
+        counter = iter(range(100))
+        ticks = TickScheduler.TickScheduler(interval=0.01, policy=TickScheduler.TickScheduler.DROP)
+        ticks.run(lambda: next(counter), process, ticks=10)
+        assert ticks.stats.overlaps > 0
+        assert ticks.stats.skipped > 0
+        assert ticks.stats.late > 0
+        assert len(processed) < 10
+        # The last tick is never dropped
+        assert processed[-1] == 9
+
+    def test_catch_up(self):
+        processed = []
+
+        def process(data):
+            processed.append(data)
+            time.sleep(0.02)
+
+        ticks = TickScheduler.TickScheduler(interval=0.01, policy=TickScheduler.TickScheduler.CATCH_UP)
+        ticks.run(lambda: len(processed), process, ticks=6)
+        assert len(processed) == 6
+        assert ticks.stats.skipped == 0
+        assert ticks.stats.max_lag > 0
+
+    def test_slow_fetch(self):
+        def fetch():
+            time.sleep(0.035)
+
+        ticks = TickScheduler.TickScheduler(interval=0.01, policy=TickScheduler.TickScheduler.DROP)
+        ticks.run(fetch, lambda data: None, ticks=3)
+        assert ticks.stats.skipped >= 3
+
+    def test_report(self):
+        reports = []
+        ticks = TickScheduler.TickScheduler(interval=0.01, report=reports.append, report_every=2)
+        ticks.run(lambda: None, lambda data: None, ticks=5)
+        assert [stats.processed for stats in reports] == [2, 4]
+        # Reports are copies, so they do not change as more ticks are processed
+        assert reports[0] is not ticks.stats
+        assert reports[0].as_dict()['processed'] == 2
+        assert 'mean_lag' in reports[0].as_dict()
+
+        # Reports can be turned off
+        ticks = TickScheduler.TickScheduler(interval=0.01, report=reports.append, report_every=0)
+        ticks.run(lambda: None, lambda data: None, ticks=2)
+        assert ticks.stats.processed == 2
+        assert len(reports) == 2
+
+    def test_errors(self):
+        def fail():
+            raise ValueError()
+
+        ticks = TickScheduler.TickScheduler(interval=0.01)
+        ticks.run(fail, lambda data: None, ticks=2)
+        assert ticks.stats.skipped == 2
+
+        with pytest.raises(ValueError):
+            TickScheduler.TickScheduler(policy='unknown')
+        with pytest.raises(ValueError):
+            TickScheduler.TickScheduler(interval=0)
@@ -1,54 +1,183 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+import hashlib
 import json
 from itertools import cycle
 import os
 import time
+from typing import Dict, List, Tuple
 
+SCHEDULES_PATH = os.path.dirname(os.path.abspath(__file__))
+MINUTES_PER_DAY = 24 * 60
+INFO_FILENAME = 'file_info.json'
 
-def main():
-    # TODO Put soe kind of hash for diff check in metafile
-    meta_info = {'date_generated': int(time.time()), 'file_info': {}}
-    for filename in ['red_weekday.json', 'red_morning.json', 'red_sunday.json', 'red_saturday.json',
-                     'green_weekday.json',
-                     'gray_weekday.json', 'gray_night.json',
-                     'blue_weekday.json']:
-        with open(os.path.join(os.getcwd(), filename)) as cfg_file:
-            cfg = json.load(cfg_file)
+
+class ScheduleConfigError(Exception):
+    """A schedule config is malformed or describes a schedule that cannot be generated"""
+    pass
+
+
+def _to_minutes(str_time: str) -> int:
+    """Convert a time such as 07:30AM to minutes after midnight"""
+    parsed = datetime.datetime.strptime(str_time, '%I:%M%p')
+    return parsed.hour * 60 + parsed.minute
+
+
+def _format_minutes(minutes: int) -> str:
+    """Convert minutes after midnight (wrapping past midnight) to a time such as 07:30AM"""
+    minutes %= MINUTES_PER_DAY
+    return datetime.time(hour=minutes // 60, minute=minutes % 60).strftime('%I:%M%p')
+
+
+def config_hash(config_path: str) -> str:
+    """Get the SHA-256 hash of a config file's contents"""
+    with open(config_path, 'rb') as cfg_file:
+        return hashlib.sha256(cfg_file.read()).hexdigest()
+
+
+def find_configs(path: str) -> List[str]:
+    """Get the paths of all schedule configs in a directory"""
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if os.path.splitext(f)[-1] == '.json')
+
+
+def generate_rows(cur_cfg: Dict) -> List[List[str]]:
+    """
+    Generate the rows of one block of a schedule config
+    :param cur_cfg: The block, with a start_time, end_time, pattern and spacing, or a manual row
+    :return: The rows of formatted times
+    :raises ScheduleConfigError: if the block is malformed or the pattern never lands on the end time
+    """
+    if cur_cfg.get('manual'):
+        return [cur_cfg['manual']]
+    try:
+        start = _to_minutes(cur_cfg['start_time'])
+        end = _to_minutes(cur_cfg['end_time'])
+        pattern = cur_cfg['pattern']
+        spacing = cur_cfg['spacing']
+    except (KeyError, ValueError) as e:
+        raise ScheduleConfigError(f'Malformed block {cur_cfg}: {e}')
+    if not pattern or any(not isinstance(step, int) or step <= 0 for step in pattern):
+        raise ScheduleConfigError(f'Pattern {pattern} must be a non-empty list of positive minutes')
+
+    # The end time may be past midnight, so the first column runs for span minutes, ending on the end time
+    span = (end - start) % MINUTES_PER_DAY
+    if span == 0:
+        return []
+    # Every step is at least one minute, so there can never be more rows than minutes in the span
+    max_rows = span // min(pattern) + 1
+    offsets = [0]
+    steps = cycle(pattern)
+    while offsets[-1] != span:
+        if offsets[-1] > span or len(offsets) >= max_rows:
+            raise ScheduleConfigError(f'Pattern {pattern} starting at {cur_cfg["start_time"]} '
+                                      f'never lands on end time {cur_cfg["end_time"]}')
+        offsets.append(offsets[-1] + next(steps))
+
+    column_starts = [start] + [start + s for s in spacing]
+    return [[_format_minutes(col_start + offset) for col_start in column_starts] for offset in offsets]
+
+
+def generate(config_path: str, out_path: str) -> Tuple[str, Dict]:
+    """
+    Generate the CSV for a single schedule config
+    :param config_path: The path of the config
+    :param out_path: The directory to write the CSV into
+    :return: A tuple of (CSV filename, file info to record in the metafile)
+    :raises ScheduleConfigError: if the config is malformed
+    """
+    with open(config_path) as cfg_file:
+        cfg = json.load(cfg_file)
+    try:
         data = cfg['data']
         info = cfg['info']
-        print('-' * len(filename))
-        print(filename)
-        if info.get('comment'):
-            print(info['comment'])
-        print('-' * len(filename))
-
-        meta_info['file_info'][f'{info["filename"]}.csv'] = info
-
-        with open(os.path.join(os.getcwd(), 'generated', f'{info["filename"]}.csv'), 'w') as out_file:
-            print(*info['headers'], sep=',', file=out_file)
-            for cur_cfg in data:
-                if cur_cfg.get('manual'):
-                    print(*cur_cfg['manual'], sep=',', file=out_file)
-                    continue
-                start_time = datetime.datetime.strptime(cur_cfg['start_time'], '%I:%M%p')
-                end_time = datetime.datetime.strptime(cur_cfg['end_time'], '%I:%M%p')
-                col_count = len(cur_cfg['spacing']) + 1
-                column_start_times = [start_time]
-                column_start_times.extend([start_time + datetime.timedelta(minutes=s) for s in cur_cfg['spacing']])
-                column_patterns = [cycle(cur_cfg['pattern']) for _ in range(col_count)]
-                column_firsts = [True for _ in range(col_count)]
-                while column_start_times[0].time() != end_time.time():
-                    for count in range(col_count):
-                        pattern = column_patterns[count]
-                        if not column_firsts[count]:
-                            column_start_times[count] += datetime.timedelta(minutes=pattern.__next__())
-                        column_firsts[count] = False
-                        end = '' if count == col_count - 1 else ','
-                        print(column_start_times[count].time().strftime('%I:%M%p'), end=end, file=out_file)
-                    print(file=out_file)
-
-    with open(os.path.join(os.getcwd(), 'generated', 'file_info.json'), 'w') as meta_file:
-        json.dump(meta_info, fp=meta_file, separators=(',', ':'))
+        headers = info['headers']
+        csv_name = f'{info["filename"]}.csv'
+    except KeyError as e:
+        raise ScheduleConfigError(f'{config_path} is missing {e}')
+
+    rows = []
+    for cur_cfg in data:
+        for row in generate_rows(cur_cfg):
+            if len(row) != len(headers):
+                raise ScheduleConfigError(f'{config_path}: row {row} does not match the {len(headers)} headers')
+            rows.append(row)
+
+    # Write to a temporary file first so that an interrupted build never leaves a partial schedule behind
+    tmp_path = os.path.join(out_path, f'.{csv_name}.tmp')
+    with open(tmp_path, 'w') as out_file:
+        print(*headers, sep=',', file=out_file)
+        for row in rows:
+            print(*row, sep=',', file=out_file)
+    os.replace(tmp_path, os.path.join(out_path, csv_name))
+
+    info = dict(info, source=os.path.basename(config_path), hash=config_hash(config_path))
+    return csv_name, info
+
+
+def build(config_path: str = SCHEDULES_PATH, out_path: str = None, force: bool = False, workers: int = None) -> List[str]:
+    """
+    Regenerate the CSVs of every config whose contents changed since the last build
+    :param config_path: The directory containing the schedule configs
+    :param out_path: The directory to write the CSVs and metafile into. Defaults to the generated folder in config_path
+    :param force: Whether to regenerate every config regardless of its hash
+    :param workers: The number of processes to generate with. Defaults to the number of CPUs
+    :return: A list of the regenerated CSV filenames
+    :raises ScheduleConfigError: if any changed config is malformed
+    """
+    if out_path is None:
+        out_path = os.path.join(config_path, 'generated')
+    os.makedirs(out_path, exist_ok=True)
+
+    try:
+        with open(os.path.join(out_path, INFO_FILENAME)) as meta_file:
+            old_info = json.load(meta_file)['file_info']
+    except (FileNotFoundError, ValueError, KeyError):
+        old_info = {}
+    old_by_source = {info.get('source'): (csv_name, info) for csv_name, info in old_info.items()}
+
+    file_info = {}
+    changed = []
+    for cfg in find_configs(config_path):
+        csv_name, info = old_by_source.get(os.path.basename(cfg), (None, None))
+        if not force and info is not None and info.get('hash') == config_hash(cfg) and \
+                os.path.exists(os.path.join(out_path, csv_name)):
+            file_info[csv_name] = info
+        else:
+            changed.append(cfg)
+
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for csv_name, info in executor.map(generate, changed, [out_path] * len(changed)):
+                file_info[csv_name] = info
+
+    # Remove schedules whose config no longer exists so ScheduleManager does not load them
+    for csv_name in set(old_info) - set(file_info):
+        try:
+            os.remove(os.path.join(out_path, csv_name))
+        except FileNotFoundError:
+            pass
+
+    if changed or set(old_info) != set(file_info):
+        with open(os.path.join(out_path, INFO_FILENAME), 'w') as meta_file:
+            json.dump({'date_generated': int(time.time()), 'file_info': file_info}, fp=meta_file, separators=(',', ':'))
+    changed_sources = {os.path.basename(cfg) for cfg in changed}
+    return sorted(csv_name for csv_name, info in file_info.items() if info['source'] in changed_sources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate schedule CSVs from the schedule configs')
+    parser.add_argument('-c', '--configs', default=SCHEDULES_PATH, help='The directory containing the schedule configs')
+    parser.add_argument('-o', '--out', default=None, help='The output directory. Defaults to the generated folder in the config directory')
+    parser.add_argument('-f', '--force', action='store_true', help='Regenerate every config regardless of its hash')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of processes to generate with')
+    args = parser.parse_args()
+
+    regenerated = build(args.configs, args.out, force=args.force, workers=args.jobs)
+    for csv_name in regenerated:
+        print(f'generated {csv_name}')
+    if not regenerated:
+        print('schedules are up to date')
 
 
 if __name__ == '__main__':
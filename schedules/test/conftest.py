@@ -0,0 +1,5 @@
+import os
+import sys
+
+# gen_schedules.py is a standalone script, so make it importable for its tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -1,8 +1,52 @@
+import json
+import os
+
 import pytest
 
-pytest.skip('Currently no way to test gen_schedules.py', allow_module_level=True)
+import gen_schedules
+
+
+def write_config(path, name: str, data: list, headers: list = None):
+    cfg = {'info': {'route_id': 1, 'filename': name, 'valid_days': [0], 'overlap_days': [], 'headers': headers or [1, 2]},
+           'data': data}
+    with open(os.path.join(path, f'{name}.json'), 'w') as cfg_file:
+        json.dump(cfg, cfg_file)
 
 
-# TODO Clean up gen_schedules.py so that it can be moved into the lib
 class TestGenSchedules:
-    pass
+    def test_generate_rows(self):
+        rows = gen_schedules.generate_rows({'start_time': '11:30PM', 'end_time': '12:30AM', 'pattern': [20, 10], 'spacing': [5]})
+        assert rows == [['11:30PM', '11:35PM'], ['11:50PM', '11:55PM'], ['12:00AM', '12:05AM'], ['12:20AM', '12:25AM'],
+                        ['12:30AM', '12:35AM']]
+        assert gen_schedules.generate_rows({'manual': ['None', '07:30AM']}) == [['None', '07:30AM']]
+
+    def test_generate_rows_invalid(self):
+        with pytest.raises(gen_schedules.ScheduleConfigError):
+            gen_schedules.generate_rows({'start_time': '07:30AM', 'end_time': '08:00AM', 'pattern': [20], 'spacing': []})
+        with pytest.raises(gen_schedules.ScheduleConfigError):
+            gen_schedules.generate_rows({'start_time': '07:30AM', 'end_time': '08:00AM', 'pattern': [0], 'spacing': []})
+        with pytest.raises(gen_schedules.ScheduleConfigError):
+            gen_schedules.generate_rows({'start_time': '07:30AM', 'pattern': [10], 'spacing': []})
+
+    def test_build(self, tmp_path):
+        config_path, out_path = str(tmp_path), str(tmp_path / 'generated')
+        block = {'start_time': '07:30AM', 'end_time': '08:00AM', 'pattern': [15], 'spacing': [5]}
+        write_config(config_path, 'first', [block])
+        write_config(config_path, 'second', [block])
+
+        assert gen_schedules.build(config_path, workers=1) == ['first.csv', 'second.csv']
+        with open(os.path.join(out_path, 'first.csv')) as csv_file:
+            assert csv_file.read() == '1,2\n07:30AM,07:35AM\n07:45AM,07:50AM\n08:00AM,08:05AM\n'
+
+        # Only changed configs are regenerated
+        assert gen_schedules.build(config_path, workers=1) == []
+        write_config(config_path, 'second', [dict(block, end_time='07:45AM')])
+        assert gen_schedules.build(config_path, workers=1) == ['second.csv']
+        assert gen_schedules.build(config_path, force=True, workers=1) == ['first.csv', 'second.csv']
+
+        # Schedules of removed configs are removed
+        os.remove(os.path.join(config_path, 'first.json'))
+        gen_schedules.build(config_path, workers=1)
+        assert not os.path.exists(os.path.join(out_path, 'first.csv'))
+        with open(os.path.join(out_path, 'file_info.json')) as meta_file:
+            assert list(json.load(meta_file)['file_info']) == ['second.csv']
@@ -1,4 +1,7 @@
+import argparse
+import asyncio
 from configparser import ConfigParser
+from datetime import timedelta
 import logging
 import os
 import sys
@@ -7,8 +10,18 @@ import time
 
 import psycopg2
 
+import ArrivalService
+import AsyncEngine
+import EventBus
+import EventLog
+import HeadwayMonitor
+import Profiler
+import RouteTopology
 import ScheduleManager
+import ShuttleProcessor
 import ShuttleService
+import StopDetector
+import TickScheduler
 
 
 def parse_config(file: str = 'database.ini', db_type: str = 'postgresql'):
@@ -22,38 +35,143 @@ def parse_config(file: str = 'database.ini', db_type: str = 'postgresql'):
     return data
 
 
-def process_shuttle(scheduler: ScheduleManager.ScheduleManager, shuttle: ShuttleService.Shuttle, db: psycopg2):
-    stops_by_route = scheduler.stops_by_route()
-    try:
-        stops = stops_by_route[shuttle.route_id]
-    except KeyError:
-        print(f'unknown route {shuttle.route_id}')
-        return
-    for stop in stops:
-        if stop.at_stop(shuttle.position, 30) and scheduler.validate_stop(shuttle.id, stop.id):
-            nearest_time = scheduler.get_nearest_time(shuttle.route_id, stop.id, shuttle.timestamp)
-            with db.cursor() as cur:
-                cur.execute('INSERT INTO "ConfirmedStop" (shuttle, route, stop, arrival_time, expected_time) VALUES (%s, %s, %s, %s, %s)',
-                            (shuttle.id, shuttle.route_id, stop.id, shuttle.timestamp, nearest_time))
-            logging.info(msg=(f'{threading.get_ident()}:{scheduler.get_route_name(shuttle.route_id)}\n'
-                              f'\tShuttle ID {shuttle.id} stopped at ({stop.name}) at {shuttle.timestamp}. Nearest time in table: {nearest_time}'))
-            break
+def process_shuttle(scheduler: ScheduleManager.ScheduleManager, shuttle: ShuttleService.Shuttle, db: psycopg2, events: EventLog.EventLog,
+                    detector: StopDetector.StopDetector, monitor: HeadwayMonitor.HeadwayMonitor = None, bus: EventBus.EventBus = None):
+    def write(shuttle_id, route_id, stop_id, arrival_time, expected_time):
+        with db.cursor() as cur:
+            cur.execute('INSERT INTO "ConfirmedStop" (shuttle, route, stop, arrival_time, expected_time) VALUES (%s, %s, %s, %s, %s)',
+                        (shuttle_id, route_id, stop_id, arrival_time, expected_time))
+
+    ShuttleProcessor.process_shuttle(scheduler, shuttle, write, events, detector, monitor, bus)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Track Stevens shuttles against their paper schedules')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='Process shuttles with one thread each, or with coroutines on a single event loop')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between polls of the feed. Stops passed between polls are still detected')
+    parser.add_argument('--no-headways', action='store_true', help='Disable bunching and route substitution monitoring')
+    parser.add_argument('--tick-budget', type=float, default=None, help='Seconds a tick may take before it is counted as late')
+    parser.add_argument('--catch-up', action='store_true', help='Process every tick when behind instead of dropping stale ticks')
+    parser.add_argument('--shuttle-timeout', type=float, default=10.0,
+                        help='Seconds a tick waits for its shuttles before abandoning the ones that are stuck')
+    parser.add_argument('--stats-every', type=int, default=60, help='Record the tick stats in the event log every N ticks, or never if 0')
+    parser.add_argument('--query-port', type=int, default=None, help='Serve next-arrival queries over HTTP on this local port')
+    parser.add_argument('--stream-port', type=int, default=None,
+                        help='Stream confirmed stops and shuttle positions as server-sent events on this local port')
+    parser.add_argument('--event-log', default=os.path.join(os.getcwd(), 'events', 'events.jsonl'),
+                        help='The path of the JSONL event log. Rotated logs are gzipped next to it')
+    parser.add_argument('--quiet', action='store_true', help='Do not echo events to stdout')
+    parser.add_argument('--profile-ticks', type=int, default=30, help='The number of ticks to profile when SIGUSR1 is received')
+    parser.add_argument('--profile-port', type=int, default=None, help='Accept profiling commands on this local port')
+    parser.add_argument('--profile-dir', default=os.path.join(os.getcwd(), 'profiles'), help='The directory to write profiles into')
+    parser.add_argument('--time-calls', type=int, default=None, metavar='N',
+                        help='Time one in every N calls of the ScheduleManager and ShuttleService methods')
+    args = parser.parse_args()
+    if args.interval <= 0:
+        parser.error('--interval must be positive')
+    if args.stats_every < 0:
+        parser.error('--stats-every must not be negative')
+    if args.time_calls is not None and args.time_calls < 1:
+        parser.error('--time-calls must be at least 1')
+    if args.engine == 'asyncio' and args.catch_up:
+        parser.error('--catch-up is only supported by the threads engine, since the asyncio engine never overlaps ticks')
+
     logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(levelname)s:%(message)s')
 
-    db: psycopg2 = psycopg2.connect(**parse_config())
-    db.set_session(autocommit=True)
+    call_timer = None
+    if args.time_calls is not None:
+        call_timer = Profiler.CallTimer(sample_every=args.time_calls)
+        call_timer.instrument(ScheduleManager.ScheduleManager)
+        call_timer.instrument(ShuttleService.ShuttleService)
+    profiler = Profiler.TickProfiler(args.profile_dir, call_timer=call_timer)
+    profiler.install_signal_handlers(args.profile_ticks)
+    if args.profile_port is not None:
+        profiler.serve(port=args.profile_port)
 
-    sm = ShuttleService.ShuttleManager(307)
     scheduler: ScheduleManager.ScheduleManager = ScheduleManager.ScheduleManager(307, os.path.join(os.getcwd(), 'schedules', 'generated'),
                                                                                  'America/New_York')
+    # Shuttles start and end their loops at Howe Center, so they may come back to it before any other stop
+    for stops in scheduler.stops_by_route().values():
+        for stop in stops:
+            if 'Howe Center' in stop.name:
+                scheduler.topology.set_rule(stop.id, RouteTopology.Terminal())
+    events = EventLog.EventLog(args.event_log, echo=not args.quiet, route_name=scheduler.get_route_name)
+    monitor = None if args.no_headways else HeadwayMonitor.HeadwayMonitor(scheduler.stops_by_route())
+    arrivals = None
+    if args.query_port is not None:
+        arrivals = ArrivalService.ArrivalService(scheduler)
+        ArrivalService.serve(arrivals, port=args.query_port)
+    bus = None
+    if args.stream_port is not None:
+        bus = EventBus.EventBus()
+        EventBus.serve(bus, port=args.stream_port)
+    # Keep interpolating between polls however far apart they are
+    detector = StopDetector.StopDetector(box_size=30, max_gap=max(timedelta(minutes=2), timedelta(seconds=4 * args.interval)))
+
+    def report_stats(stats):
+        events.record('tick_stats', **stats.as_dict())
+
+    if args.engine == 'asyncio':
+        def on_shuttles(agency_id, shuttles):
+            if arrivals is not None:
+                arrivals.update(shuttles)
+            if bus is not None:
+                bus.publish_positions(shuttles)
+
+        try:
+            engine, _ = asyncio.run(AsyncEngine.run({307: scheduler}, parse_config(), events, interval=args.interval, monitors={307: monitor} if monitor else None,
+                                                    on_shuttles=on_shuttles, profiler=profiler, bus=bus, detector=detector,
+                                                    budget=args.tick_budget, report=report_stats, report_every=args.stats_every))
+            logging.info(msg=f'Tick stats: {engine.stats}')
+        finally:
+            events.close()
+        return
+
+    db: psycopg2 = psycopg2.connect(**parse_config())
+    db.set_session(autocommit=True)
+    sm = ShuttleService.ShuttleManager(307)
 
-    while True:
-        for shuttle in sm.shuttles():
-            threading.Thread(target=process_shuttle, args=(scheduler, shuttle, db)).start()
-        time.sleep(1 - (time.time() % 1))
+    def fetch():
+        # Fetching runs on this thread while the tick before is processed on the tick scheduler's worker thread
+        with profiler.profiled():
+            return sm.shuttles()
+
+    pruner = ShuttleProcessor.Pruner(detector)
+
+    def profiled_process_shuttle(*process_args):
+        with profiler.profiled():
+            process_shuttle(*process_args)
+
+    def process(shuttles):
+        with profiler.tick():
+            if arrivals is not None:
+                arrivals.update(shuttles)
+            if bus is not None:
+                bus.publish_positions(shuttles)
+            pruner.prune([scheduler])
+            threads = [(shuttle, threading.Thread(target=profiled_process_shuttle,
+                                                  args=(scheduler, shuttle, db, events, detector, monitor, bus), daemon=True))
+                       for shuttle in shuttles]
+            for _, thread in threads:
+                thread.start()
+            # Wait for every shuttle so the tick scheduler can tell when a tick runs long,
+            # but do not let a stuck shuttle hold up every tick after it
+            give_up = time.monotonic() + args.shuttle_timeout
+            for shuttle, thread in threads:
+                thread.join(max(give_up - time.monotonic(), 0))
+                if thread.is_alive():
+                    events.error('Abandoned a stuck shuttle', shuttle_id=shuttle.id, route_id=shuttle.route_id)
+
+    ticks = TickScheduler.TickScheduler(interval=args.interval, budget=args.tick_budget,
+                                        policy=TickScheduler.TickScheduler.CATCH_UP if args.catch_up else TickScheduler.TickScheduler.DROP,
+                                        report=report_stats, report_every=args.stats_every)
+    try:
+        ticks.run(fetch, process)
+    finally:
+        logging.info(msg=f'Tick stats: {ticks.stats}')
+        events.close()
 
 
 if __name__ == '__main__':